@@ -1,5 +1,8 @@
 #!/bin/bash
+# Ogni job salva in src/results/<JOB_NAME>/regression/threshold.json la soglia scelta sul validation set.
+# Con "export REGRESSION_THRESHOLD=auto" nel file .sbatch, la matrice "default" del report usa questa soglia e
+# un nuovo lancio dello stesso job (stesso JOB_NAME) la usa anche per la metrica bin_acc del training.
 for f in *.sbatch
 do
     sbatch "$f"
-done
\ No newline at end of file
+done
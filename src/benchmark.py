@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from os import makedirs, path
+
+import synthetic_data
+
+"""
+Benchmark della pipeline su dataset sintetici di dimensione crescente.
+Per ogni scala viene eseguito invalsi.py (un'epoca, PROFILING=True) e vengono raccolti i tempi degli stage,
+il tempo dell'epoca di training e il picco di memoria, così da rendere visibili le regressioni fra commit.
+I tempi vengono misurati senza cProfile e tracemalloc (PROFILE_STAGES=False), che rallenterebbero soprattutto gli stage
+in Python puro come la lettura del dataset originale; con --profile vengono raccolti anche i profili, in un'esecuzione
+i cui tempi non sono confrontabili con quelli senza profili.
+Con --smoke la pipeline viene eseguita su pochi record, partendo sia dal dataset originale sia da quello con ambiti e
+processi, e il benchmark termina con errore se una delle esecuzioni non completa l'epoca di training.
+Va lanciato dalla cartella principale del repository, come invalsi.py.
+"""
+
+DEFAULT_SCALES = [10_000, 100_000, 1_000_000, 10_000_000, 50_000_000]
+SMOKE_ROWS = 5_000
+BENCHMARK_FOLDER = path.join("src", "results", "benchmark")
+RESULTS_FILE_NAME = "benchmark.jsonl"
+
+# Stage di invalsi.py (vedi profiling.py) riportati nella tabella riassuntiva.
+REPORTED_STAGES = ["read_original_dataset", "convert_domande_to_ambiti_processi", "read_dataset_ap", "fill_nan",
+                   "sampling", "pd_dataframe_to_tf_dataset", "training", "evaluation"]
+
+
+def ensure_dataset(file_path: str, rows: int, dataset_ap: bool):
+    if not path.exists(file_path):
+        print(f"Generating {file_path} ({rows:,} records)")
+        synthetic_data.write_csv(file_path, rows, dataset_ap)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def benchmark_job_name(rows: int, ingest: bool) -> str:
+    return f"benchmark_{rows}_ingest" if ingest else f"benchmark_{rows}"
+
+
+def run_pipeline(rows: int, data_folder: str, ingest: bool, problem_type: str, profile: bool = False) -> dict:
+    """
+    Runs invalsi.py for one epoch on rows synthetic records and returns the collected measures.
+    With ingest, the pipeline starts from the original CSV (reading, cleaning and ambiti/processi conversion),
+    otherwise from the cleaned CSV with ambiti and processi. With profile, the stages are also profiled with cProfile
+    and tracemalloc, which slows them down.
+    """
+    job_name = benchmark_job_name(rows, ingest)
+    original_dataset = path.join(data_folder, f"original_dataset_{rows}.csv")
+    dataset_ap = path.join(data_folder, f"dataset_ap_{rows}.csv")
+    if ingest:
+        ensure_dataset(original_dataset, rows, dataset_ap=False)
+    else:
+        ensure_dataset(dataset_ap, rows, dataset_ap=True)
+
+    env = os.environ.copy()
+    env.update({
+        "JOB_NAME": job_name,
+        "PROBLEM_TYPE": problem_type,
+        "ORIGINAL_DATASET": original_dataset,
+        "CLEANED_DATASET": path.join(data_folder, f"cleaned_dataset_{rows}.csv"),
+        "CLEANED_DATASET_WITH_AP": dataset_ap,
+        "PRE_ML": str(ingest),
+        "SAVE_CLEANED_DATASET": str(ingest),
+        "CONVERT_DOMANDE_TO_AMBITI_PROCESSI": str(ingest),
+        "EPOCH": "1",
+        "EARLY_STOPPING": "False",
+        "PROFILING": "True",
+        "PROFILE_STAGES": str(profile),
+        "TELEMETRY": "True",
+    })
+
+    makedirs(BENCHMARK_FOLDER, exist_ok=True)
+    # I file dei risultati di JOB_NAME possono contenere esecuzioni precedenti: si leggono solo i record successivi.
+    start_time = time.time()
+    start = time.perf_counter()
+    with open(path.join(BENCHMARK_FOLDER, f"{job_name}.log"), "w") as log_file:
+        process = subprocess.Popen([sys.executable, path.join("src", "invalsi.py")], env=env,
+                                   stdout=log_file, stderr=subprocess.STDOUT)
+        # wait4 restituisce l'utilizzo di risorse del solo processo figlio (ru_maxrss in kilobyte su Linux).
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    wall_time = time.perf_counter() - start
+
+    results_folder = path.join("src", "results", job_name, problem_type)
+    stages = {}
+    stages_path = path.join(results_folder, "profiles", "stages.json")
+    if path.exists(stages_path) and path.getmtime(stages_path) >= start_time:
+        with open(stages_path) as stages_file:
+            stages = {record["stage"]: record for record in json.load(stages_file)}
+
+    epoch_time = None
+    telemetry_path = path.join(results_folder, "telemetry.jsonl")
+    if path.exists(telemetry_path):
+        with open(telemetry_path) as telemetry_file:
+            epochs = [record for record in map(json.loads, telemetry_file)
+                      if record["event"] == "epoch" and record["time"] >= start_time]
+        if epochs:
+            epoch_time = epochs[-1]["wall_time"]
+
+    return {
+        "rows": rows,
+        "ingest": ingest,
+        "problem_type": problem_type,
+        "profiled": profile,
+        "exit_code": process.returncode,
+        "wall_time": wall_time,
+        "max_rss_mb": usage.ru_maxrss / 1024,
+        "epoch_time": epoch_time,
+        "stages": {name: {"wall_time": record["wall_time"],
+                          "peak_traced_mb": record["peak_traced_mb"],
+                          "peak_rss_mb": record["peak_rss_mb"]} for name, record in stages.items()},
+        "commit": git_commit(),
+        "time": time.time(),
+    }
+
+
+def smoke_test(data_folder: str, problem_type: str) -> bool:
+    """
+    Runs the pipeline on SMOKE_ROWS records, starting both from the original dataset and from the cleaned one
+    with ambiti and processi, and returns whether every run completed its training epoch.
+    """
+    results = [run_pipeline(SMOKE_ROWS, data_folder, ingest, problem_type) for ingest in [False, True]]
+    print_results(results)
+    failed = [result for result in results if result["exit_code"] != 0 or result["epoch_time"] is None]
+    for result in failed:
+        print(f"Smoke run {'from the original dataset' if result['ingest'] else 'from the cleaned dataset'} "
+              f"did not complete the training epoch, see "
+              f"{path.join(BENCHMARK_FOLDER, benchmark_job_name(SMOKE_ROWS, result['ingest']) + '.log')}")
+    return not failed
+
+
+def print_results(results: list):
+    print(f"{'Rows':>12}{'Exit':>6}{'Total (s)':>11}{'Max RSS (MB)':>14}{'Epoch (s)':>11}  Stages (s)")
+    for result in results:
+        stages = ", ".join(f"{name}={result['stages'][name]['wall_time']:.2f}"
+                           for name in REPORTED_STAGES if name in result["stages"])
+        epoch_time = f"{result['epoch_time']:.2f}" if result["epoch_time"] is not None else "-"
+        print(f"{result['rows']:>12,}{result['exit_code']:>6}{result['wall_time']:>11.1f}"
+              f"{result['max_rss_mb']:>14.0f}{epoch_time:>11}  {stages}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures time and memory of the pipeline on synthetic datasets.")
+    parser.add_argument("--rows", type=lambda rows: [int(r) for r in rows.split(",")], default=DEFAULT_SCALES,
+                        help="comma separated list of dataset sizes")
+    parser.add_argument("--data-folder", default=path.join("..", "nuovi_dataset", "synthetic"))
+    parser.add_argument("--max-ingest-rows", type=int, default=1_000_000,
+                        help="above this size the pipeline starts from the cleaned dataset with ambiti and processi")
+    parser.add_argument("--problem-type", choices=["classification", "regression", "pure_regression"],
+                        default="classification")
+    parser.add_argument("--profile", action="store_true",
+                        help="also collects the cProfile statistics and the traced memory of the stages "
+                             "(the measured times include the profiler overhead)")
+    parser.add_argument("--smoke", action="store_true",
+                        help=f"only checks that the pipeline reaches the end of a training epoch on {SMOKE_ROWS:,} "
+                             f"records, starting from both datasets")
+    arguments = parser.parse_args()
+
+    makedirs(arguments.data_folder, exist_ok=True)
+    if arguments.smoke:
+        sys.exit(0 if smoke_test(arguments.data_folder, arguments.problem_type) else 1)
+
+    results = []
+    for rows in arguments.rows:
+        result = run_pipeline(rows, arguments.data_folder, rows <= arguments.max_ingest_rows, arguments.problem_type,
+                              arguments.profile)
+        results.append(result)
+        with open(path.join(BENCHMARK_FOLDER, RESULTS_FILE_NAME), "a") as results_file:
+            results_file.write(json.dumps(result) + "\n")
+        print_results(results[-1:])
+
+    print()
+    print_results(results)
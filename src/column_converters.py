@@ -131,4 +131,9 @@ COLUMN_CONVERTERS = {
     "n_classi_prev": lambda val: int(float(val)),
     "LIVELLI": int,
     "DROPOUT": lambda val: 1 if val == "True" else 0 # contiene True e False
-}
\ No newline at end of file
+}
+
+# Colonne categoriche stringa: rileggendo un CSV già convertito (ad esempio CLEANED_DATASET_WITH_AP), read_csv dedurrebbe
+# un tipo numerico per quelle con codici come "15" o "2003" (Cod_reg, anno, ...), quindi il tipo va forzato con dtype=.
+STRING_COLUMNS_DTYPES = {name: str for name, converter in COLUMN_CONVERTERS.items() if converter is str}
+STRING_COLUMNS_DTYPES["sigla_provincia_istat"] = str
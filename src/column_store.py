@@ -0,0 +1,76 @@
+import json
+from os import makedirs, path
+
+import numpy as np
+import pandas as pd
+
+"""
+Archivio a colonne del dataset: ogni colonna è un file .npy che può essere aperto con memory mapping, così che più
+processi (ad esempio i training per regione di regional_training.py) condividano le pagine del dataset caricato una sola
+volta invece di rileggere e convertire il CSV ognuno per conto proprio.
+Le colonne stringa vengono salvate come codici interi più l'elenco delle categorie.
+"""
+
+MANIFEST_FILE_NAME = "columns.json"
+
+
+def write(dataframe: pd.DataFrame, folder: str):
+    makedirs(folder, exist_ok=True)
+    columns = {}
+    for col in dataframe.columns:
+        file_name = f"{len(columns)}.npy"
+        if dataframe[col].dtype == object:
+            codes, categories = pd.factorize(dataframe[col])
+            np.save(path.join(folder, file_name), codes.astype(np.int32))
+            columns[col] = {"file": file_name, "categories": [str(category) for category in categories]}
+        else:
+            np.save(path.join(folder, file_name), dataframe[col].to_numpy())
+            columns[col] = {"file": file_name}
+
+    with open(path.join(folder, MANIFEST_FILE_NAME), "w") as manifest_file:
+        json.dump({"rows": len(dataframe), "columns": columns}, manifest_file)
+
+
+def read_manifest(folder: str) -> dict:
+    with open(path.join(folder, MANIFEST_FILE_NAME)) as manifest_file:
+        return json.load(manifest_file)
+
+
+def open_column(folder: str, column: dict) -> np.ndarray:
+    return np.load(path.join(folder, column["file"]), mmap_mode='r')
+
+
+def column_values(folder: str, column: dict, rows=slice(None)) -> np.ndarray:
+    """
+    Returns the values of the given rows of a column (a slice or an array of indexes);
+    only the pages containing those rows are read from the memory mapped file.
+    """
+    values = open_column(folder, column)[rows]
+    if "categories" in column:
+        # Il codice -1 (valore nullo) seleziona l'ultimo elemento, cioè NaN.
+        categories = np.asarray(column["categories"] + [np.nan], dtype=object)
+        return categories[values]
+    return np.asarray(values)
+
+
+def row_filter_mask(folder: str, manifest: dict, row_filter: str) -> np.ndarray:
+    """
+    Returns the mask of the records matching row_filter, written as "column=value".
+    """
+    filter_column, filter_value = row_filter.split("=", 1)
+    column = manifest["columns"][filter_column]
+    if "categories" in column:
+        if filter_value not in column["categories"]:
+            return np.zeros(manifest["rows"], dtype=bool)
+        return open_column(folder, column) == column["categories"].index(filter_value)
+    return open_column(folder, column).astype(str) == filter_value
+
+
+def read(folder: str, row_filter: str = "") -> pd.DataFrame:
+    """
+    Reads the column store in folder as a DataFrame, keeping only the records matching row_filter ("column=value")
+    if it is not empty.
+    """
+    manifest = read_manifest(folder)
+    rows = np.flatnonzero(row_filter_mask(folder, manifest, row_filter)) if row_filter else slice(None)
+    return pd.DataFrame({col: column_values(folder, column, rows) for col, column in manifest["columns"].items()})
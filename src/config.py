@@ -1,5 +1,7 @@
+import re
+
 from tensorflow.keras import optimizers
-from os import getenv
+from os import getenv, path
 
 LEARNING_RATE = float(getenv(key="LEARNING_RATE", default="0.001"))
 DROPOUT_LAYER = eval(getenv(key="DROPOUT_LAYER", default="False"))
@@ -21,29 +23,89 @@ JOB_NAME = getenv(key="JOB_NAME", default="default")
 DROPOUT_HIDDEN_LAYER_RATE = float(getenv(key="DROPOUT_HIDDEN_LAYER_RATE", default="0.5"))
 DROPOUT_INPUT_LAYER_RATE = float(getenv(key="DROPOUT_INPUT_LAYER_RATE", default="0.8"))
 BATCH_NORMALIZATION = getenv(key="BATCH_NORMALIZATION", default="no")
+EVALUATION_BATCH_SIZE = int(getenv(key="EVALUATION_BATCH_SIZE", default="4096"))
+REGRESSION_THRESHOLD = getenv(key="REGRESSION_THRESHOLD", default="0.6")
+TELEMETRY = eval(getenv(key="TELEMETRY", default="True"))
+TELEMETRY_STEPS = int(getenv(key="TELEMETRY_STEPS", default="100"))
+PROFILING = eval(getenv(key="PROFILING", default="False"))
+PROFILE_STAGES = eval(getenv(key="PROFILE_STAGES", default="True"))
+PROFILE_STEPS = getenv(key="PROFILE_STEPS", default="")
+PLOT_LAYOUT = getenv(key="PLOT_LAYOUT", default="separate")
+PRE_ML = eval(getenv(key="PRE_ML", default="False"))
+SAVE_CLEANED_DATASET = eval(getenv(key="SAVE_CLEANED_DATASET", default="False"))
+CONVERT_DOMANDE_TO_AMBITI_PROCESSI = eval(getenv(key="CONVERT_DOMANDE_TO_AMBITI_PROCESSI", default="False"))
+PRUNE_CORRELATED_FEATURES = eval(getenv(key="PRUNE_CORRELATED_FEATURES", default="False"))
+CORRELATION_THRESHOLD = float(getenv(key="CORRELATION_THRESHOLD", default="0.95"))
+CORRELATION_SAMPLE_ROWS = int(getenv(key="CORRELATION_SAMPLE_ROWS", default="1000000"))
+PARTITIONED_DATASET = getenv(key="PARTITIONED_DATASET", default="")
+COLUMN_STORE = getenv(key="COLUMN_STORE", default="")
+PARTITION_FILTER = getenv(key="PARTITION_FILTER", default="")
+INTRA_OP_THREADS = int(getenv(key="INTRA_OP_THREADS", default="0"))
+SAVE_TEST_SET = eval(getenv(key="SAVE_TEST_SET", default="False"))
+TRAINING_SUBSAMPLE = float(getenv(key="TRAINING_SUBSAMPLE", default="1.0"))
+RUN_REGISTRY = eval(getenv(key="RUN_REGISTRY", default="True"))
+WARM_START_FROM = getenv(key="WARM_START_FROM", default="")
+COLD_BASELINE = getenv(key="COLD_BASELINE", default="")
+TARGET_LOSS = getenv(key="TARGET_LOSS", default="")
+
+RESULTS_FOLDER = path.join("src", "results", JOB_NAME, PROBLEM_TYPE)
+
+
+def config_dict() -> dict:
+    """
+    Returns the configuration of the run, in the order it is printed.
+    """
+    return {
+        "JOB_NAME": JOB_NAME,
+        "PROBLEM_TYPE": PROBLEM_TYPE,
+        "LEARNING_RATE": LEARNING_RATE,
+        "DROPOUT_LAYER": DROPOUT_LAYER,
+        "DROPOUT_INPUT_LAYER_RATE": DROPOUT_INPUT_LAYER_RATE,
+        "DROPOUT_HIDDEN_LAYER_RATE": DROPOUT_HIDDEN_LAYER_RATE,
+        "EPOCH": EPOCH,
+        "NEURONS": NEURONS,
+        "BATCH_SIZE": BATCH_SIZE,
+        "ORIGINAL_DATASET": ORIGINAL_DATASET,
+        "CLEANED_DATASET": CLEANED_DATASET,
+        "CLEANED_DATASET_WITH_AP": CLEANED_DATASET_WITH_AP,
+        "SAMPLING_TO_PERFORM": SAMPLING_TO_PERFORM,
+        "TEST_SET_PERCENT": TEST_SET_PERCENT,
+        "VALIDATION_SET_PERCENT": VALIDATION_SET_PERCENT,
+        "NUMBER_OF_LAYERS": NUMBER_OF_LAYERS,
+        "FILL_NAN": FILL_NAN,
+        "ACTIVATION_LAYER": ACTIVATION_LAYER,
+        "EARLY_STOPPING": EARLY_STOPPING,
+        "BATCH_NORMALIZATION": BATCH_NORMALIZATION,
+        "EVALUATION_BATCH_SIZE": EVALUATION_BATCH_SIZE,
+        "REGRESSION_THRESHOLD": REGRESSION_THRESHOLD,
+        "TELEMETRY": TELEMETRY,
+        "TELEMETRY_STEPS": TELEMETRY_STEPS,
+        "PROFILING": PROFILING,
+        "PROFILE_STAGES": PROFILE_STAGES,
+        "PROFILE_STEPS": PROFILE_STEPS,
+        "PLOT_LAYOUT": PLOT_LAYOUT,
+        "PRE_ML": PRE_ML,
+        "SAVE_CLEANED_DATASET": SAVE_CLEANED_DATASET,
+        "CONVERT_DOMANDE_TO_AMBITI_PROCESSI": CONVERT_DOMANDE_TO_AMBITI_PROCESSI,
+        "PRUNE_CORRELATED_FEATURES": PRUNE_CORRELATED_FEATURES,
+        "CORRELATION_THRESHOLD": CORRELATION_THRESHOLD,
+        "CORRELATION_SAMPLE_ROWS": CORRELATION_SAMPLE_ROWS,
+        "PARTITIONED_DATASET": PARTITIONED_DATASET,
+        "COLUMN_STORE": COLUMN_STORE,
+        "PARTITION_FILTER": PARTITION_FILTER,
+        "INTRA_OP_THREADS": INTRA_OP_THREADS,
+        "SAVE_TEST_SET": SAVE_TEST_SET,
+        "TRAINING_SUBSAMPLE": TRAINING_SUBSAMPLE,
+        "RUN_REGISTRY": RUN_REGISTRY,
+        "WARM_START_FROM": WARM_START_FROM,
+        "COLD_BASELINE": COLD_BASELINE,
+        "TARGET_LOSS": TARGET_LOSS,
+    }
 
 
 def print_config():
-    print("JOB_NAME:", JOB_NAME)
-    print("PROBLEM_TYPE: ", PROBLEM_TYPE)
-    print("LEARNING_RATE: ", LEARNING_RATE)
-    print("DROPOUT_LAYER: ", DROPOUT_LAYER)
-    print("DROPOUT_INPUT_LAYER_RATE: ", DROPOUT_INPUT_LAYER_RATE)
-    print("DROPOUT_HIDDEN_LAYER_RATE: ", DROPOUT_HIDDEN_LAYER_RATE)
-    print("EPOCH: ", EPOCH)
-    print("NEURONS: ", NEURONS)
-    print("BATCH_SIZE: ", BATCH_SIZE)
-    print("ORIGINAL_DATASET: ", ORIGINAL_DATASET)
-    print("CLEANED_DATASET: ", CLEANED_DATASET)
-    print("CLEANED_DATASET_WITH_AP: ", CLEANED_DATASET_WITH_AP)
-    print("SAMPLING_TO_PERFORM: ", SAMPLING_TO_PERFORM)
-    print("TEST_SET_PERCENT: ", TEST_SET_PERCENT)
-    print("VALIDATION_SET_PERCENT: ", VALIDATION_SET_PERCENT)
-    print("NUMBER_OF_LAYERS: ", NUMBER_OF_LAYERS)
-    print("FILL_NAN: ", FILL_NAN)
-    print("ACTIVATION_LAYER: ", ACTIVATION_LAYER)
-    print("EARLY_STOPPING: ", EARLY_STOPPING)
-    print("BATCH_NORMALIZATION: ", BATCH_NORMALIZATION)
+    for key, value in config_dict().items():
+        print(f"{key}: ", value)
 
 
 def check_config() -> int:
@@ -106,5 +168,71 @@ def check_config() -> int:
     if BATCH_NORMALIZATION not in ["no", "dense_batch_activation", "dense_activation_batch", "before_output"]:
         print("BATCH_NORMALIZATION should either be \"no\", \"dense_batch_activation\", \"dense_activation_batch\" or \"before_output\".")
         errors += 1
+
+    if EVALUATION_BATCH_SIZE < 1:
+        print("EVALUATION_BATCH_SIZE should be greater than 0.")
+        errors += 1
+
+    if REGRESSION_THRESHOLD != "auto":
+        try:
+            threshold = float(REGRESSION_THRESHOLD)
+        except ValueError:
+            threshold = -1
+        if threshold < 0 or threshold > 1:
+            print("REGRESSION_THRESHOLD should either be \"auto\" or in range [0..1].")
+            errors += 1
+
+    if TELEMETRY_STEPS < 1:
+        print("TELEMETRY_STEPS should be greater than 0.")
+        errors += 1
+
+    if PROFILE_STEPS and not re.fullmatch(r"\d+,\d+", PROFILE_STEPS):
+        print("PROFILE_STEPS should either be empty or \"first_step,last_step\".")
+        errors += 1
+    elif PROFILE_STEPS and int(PROFILE_STEPS.split(",")[0]) > int(PROFILE_STEPS.split(",")[1]):
+        print("PROFILE_STEPS first step should not be greater than the last one.")
+        errors += 1
+
+    if PLOT_LAYOUT not in ["separate", "panel", "both"]:
+        print("PLOT_LAYOUT should be \"separate\", \"panel\" or \"both\".")
+        errors += 1
+
+    if CORRELATION_THRESHOLD < 0 or CORRELATION_THRESHOLD > 1:
+        print("CORRELATION_THRESHOLD should be in range [0..1].")
+        errors += 1
+
+    if CORRELATION_SAMPLE_ROWS < 0:
+        print("CORRELATION_SAMPLE_ROWS should be greater than or equal to 0 (0 uses every record).")
+        errors += 1
+
+    if PARTITION_FILTER and "=" not in PARTITION_FILTER:
+        print("PARTITION_FILTER should either be empty or \"column=value\".")
+        errors += 1
+
+    if INTRA_OP_THREADS < 0:
+        print("INTRA_OP_THREADS should be greater than or equal to 0 (0 lets TensorFlow choose).")
+        errors += 1
+
+    if TRAINING_SUBSAMPLE <= 0 or TRAINING_SUBSAMPLE > 1:
+        print("TRAINING_SUBSAMPLE should be in range (0..1].")
+        errors += 1
+
+    if WARM_START_FROM == JOB_NAME:
+        print("WARM_START_FROM should be the JOB_NAME of a previous run, not of this one.")
+        errors += 1
+
+    if COLD_BASELINE and COLD_BASELINE in [JOB_NAME, WARM_START_FROM]:
+        print("COLD_BASELINE should be the JOB_NAME of a previous run with the same configuration, started without "
+              "WARM_START_FROM, not of this run or of WARM_START_FROM.")
+        errors += 1
+
+    if TARGET_LOSS:
+        try:
+            target_loss = float(TARGET_LOSS)
+        except ValueError:
+            target_loss = -1
+        if target_loss <= 0:
+            print("TARGET_LOSS should either be empty (best validation loss of COLD_BASELINE) or greater than 0.")
+            errors += 1
     
     return errors
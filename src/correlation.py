@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+BLOCK_ROWS = 100_000
+
+
+def blockwise_correlation(dataframe: pd.DataFrame, columns: list, sample_rows: int = 0,
+                          block_rows: int = BLOCK_ROWS) -> pd.DataFrame:
+    """
+    Computes the Pearson correlation matrix of columns like dataframe[columns].corr(), i.e. using for each pair
+    only the records where both values are not NaN. Records are converted to float32 one block of block_rows at a
+    time, so the whole float64 frame is never materialized. The sums and products within a block are float32 matrix
+    products (on values centred on an estimate of the mean, to limit the rounding error); only the totals over the
+    blocks are accumulated in float64.
+    If sample_rows > 0 and the dataframe is larger, the correlation is computed on a random sample of sample_rows records.
+    """
+    rows = len(dataframe)
+    if 0 < sample_rows < rows:
+        positions = np.sort(np.random.default_rng(19).choice(rows, size=sample_rows, replace=False))
+    else:
+        positions = np.arange(rows)
+    column_positions = [dataframe.columns.get_loc(col) for col in columns]
+
+    size = len(columns)
+    counts = np.zeros((size, size))
+    sums = np.zeros((size, size))
+    squares = np.zeros((size, size))
+    products = np.zeros((size, size))
+    shift = None
+    for start in range(0, positions.size, block_rows):
+        block = dataframe.iloc[positions[start:start + block_rows], column_positions].to_numpy(dtype=np.float32)
+        if shift is None:
+            # Sottrarre una stima della media riduce la perdita di precisione delle somme dei quadrati.
+            with np.errstate(invalid="ignore"):
+                shift = np.nan_to_num(np.nanmean(block, axis=0))
+        block -= shift
+
+        valid = ~np.isnan(block)
+        values = np.where(valid, block, np.float32(0))
+        valid = valid.astype(np.float32)
+        # Elemento (i, j): somma sui record in cui sia la colonna i sia la colonna j sono valorizzate.
+        counts += valid.T @ valid
+        sums += values.T @ valid
+        squares += (values * values).T @ valid
+        products += values.T @ values
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = products - sums * sums.T / counts
+        variance = squares - sums ** 2 / counts
+        correlation = covariance / np.sqrt(variance * variance.T)
+    np.fill_diagonal(correlation, 1.0)
+    return pd.DataFrame(np.clip(correlation, -1.0, 1.0), index=columns, columns=columns)
+
+
+def correlated_features_to_drop(correlation: pd.DataFrame, threshold: float) -> list:
+    """
+    Greedily selects the features to drop: following the order of the correlation matrix, a feature is dropped if its
+    absolute correlation with an already kept feature is greater than threshold.
+    Returns a list of (dropped feature, kept feature, correlation).
+    """
+    kept = []
+    dropped = []
+    for col in correlation.columns:
+        partners = [(other, correlation.at[col, other]) for other in kept
+                    if abs(correlation.at[col, other]) > threshold]
+        if partners:
+            other, value = max(partners, key=lambda partner: abs(partner[1]))
+            dropped.append((col, other, float(value)))
+        else:
+            kept.append(col)
+    return dropped
+
+
+def hidden_macs_per_record(input_width: int, neurons: int, layers: int, outputs: int) -> int:
+    """
+    Multiply-accumulate operations of the dense layers of the model for a single record.
+    """
+    return input_width * neurons + (layers - 1) * neurons * neurons + neurons * outputs
+
+
+def print_pruning(dropped: list, candidates: int):
+    print(f"Removed {len(dropped)} of {candidates} continuous features with correlation above the threshold:")
+    for col, other, value in dropped:
+        print(f"  {col} (correlation with {other}: {value:.3f})")
+
+
+def print_savings(removed_width: int, input_width: int, neurons: int, layers: int, outputs: int, epoch_time: float = None):
+    """
+    Prints the input width saved by the pruning and, given the measured epoch time of the pruned model, an estimate
+    (not a measure) of the epoch time without pruning, assuming it is proportional to the multiply-accumulate
+    operations of the dense layers. The estimate ignores the input pipeline and the preprocessing layers: to measure
+    the saving, compare the epoch times in the telemetry of a run with PRUNE_CORRELATED_FEATURES=False.
+    """
+    macs = hidden_macs_per_record(input_width, neurons, layers, outputs)
+    unpruned_macs = hidden_macs_per_record(input_width + removed_width, neurons, layers, outputs)
+    print(f"Input width: {input_width + removed_width} -> {input_width} "
+          f"({100 * (1 - macs / unpruned_macs):.1f}% fewer operations per record in the dense layers)")
+    if epoch_time is not None:
+        estimated = epoch_time * unpruned_macs / macs
+        print(f"Epoch time: {epoch_time:.2f}s measured with pruning, {estimated:.2f}s estimated without pruning "
+              f"from the operation count (not measured)")
@@ -0,0 +1,290 @@
+import json
+from os import makedirs, path
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+import config as cfg
+
+REPORT_FILE_NAME = "evaluation.json"
+THRESHOLD_FILE_NAME = "threshold.json"
+TEST_SET_FILE_NAME = "test_set.pkl"
+# Numero massimo di punti delle curve ROC e PR salvati nel report JSON.
+CURVE_POINTS = 1000
+# Stessa costante usata da Keras per evitare log(0) nel calcolo delle loss.
+EPSILON = 1e-7
+
+
+def predict_full(model: tf.keras.Model, features: Union[dict, pd.DataFrame], batch_size: int = None) -> np.ndarray:
+    """
+    Predicts every record of features (a DataFrame or a dict of columns; no record is dropped) in batches of
+    batch_size records (EVALUATION_BATCH_SIZE by default).
+    Records are not shuffled, so the i-th prediction refers to the i-th record of features.
+    """
+    dataset = tf.data.Dataset.from_tensor_slices(dict(features))
+    dataset = dataset.batch(batch_size or cfg.EVALUATION_BATCH_SIZE).prefetch(tf.data.AUTOTUNE)
+    return model.predict(dataset, verbose=0)
+
+
+def dropout_scores(predictions: np.ndarray, problem_type: str = None) -> np.ndarray:
+    """
+    Converts the predictions of a model trained for problem_type (PROBLEM_TYPE if None) to a score where higher values
+    mean "more likely DROPOUT".
+    """
+    problem_type = problem_type or cfg.PROBLEM_TYPE
+    if problem_type == "classification":
+        # La prima colonna del one-hot corrisponde a DROPOUT = True.
+        return predictions[:, 0]
+    elif problem_type == "regression":
+        # I LIVELLI sono stati invertiti, quindi valori alti corrispondono a DROPOUT = True.
+        return predictions[:, 0]
+    else: # problem_type == "pure_regression"
+        return 1.0 - predictions[:, 0]
+
+
+def compute_loss(target: np.ndarray, predictions: np.ndarray) -> float:
+    """
+    Computes the same loss the model is compiled with, over the whole test set.
+    """
+    predictions = predictions.astype(np.float64)
+    if cfg.PROBLEM_TYPE == "classification":
+        clipped = np.clip(predictions, EPSILON, 1.0 - EPSILON)
+        return float(-np.mean(np.sum(target * np.log(clipped), axis=-1)))
+    elif cfg.PROBLEM_TYPE == "regression":
+        clipped = np.clip(predictions[:, 0], EPSILON, 1.0 - EPSILON)
+        return float(-np.mean(target * np.log(clipped) + (1.0 - target) * np.log(1.0 - clipped)))
+    else: # cfg.PROBLEM_TYPE == "pure_regression"
+        return float(np.mean(np.square(target - predictions[:, 0])))
+
+
+def threshold_sweep(labels: np.ndarray, scores: np.ndarray) -> dict:
+    """
+    Computes the confusion matrix counts, precision, recall, F1 and false positive rate at every distinct threshold
+    with a single sort of the scores. A record is predicted positive when its score is >= threshold.
+    Thresholds are returned in decreasing order.
+    """
+    order = np.argsort(-scores, kind="mergesort")
+    sorted_scores = scores[order]
+    sorted_labels = labels[order].astype(np.int64)
+
+    # Indici dell'ultimo record di ogni gruppo di score uguali.
+    distinct_indexes = np.flatnonzero(np.diff(sorted_scores))
+    threshold_indexes = np.r_[distinct_indexes, sorted_labels.size - 1]
+
+    tp = np.cumsum(sorted_labels)[threshold_indexes]
+    fp = threshold_indexes + 1 - tp
+    positives = tp[-1]
+    negatives = fp[-1]
+
+    precision = tp / (tp + fp)
+    recall = tp / positives if positives > 0 else np.zeros(tp.shape)
+    fpr = fp / negatives if negatives > 0 else np.zeros(fp.shape)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+
+    return {
+        "thresholds": sorted_scores[threshold_indexes],
+        "tp": tp,
+        "fp": fp,
+        "fn": positives - tp,
+        "tn": negatives - fp,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "fpr": fpr,
+    }
+
+
+def roc_auc(sweep: dict) -> float:
+    fpr = np.r_[0.0, sweep["fpr"]]
+    tpr = np.r_[0.0, sweep["recall"]]
+    return float(np.trapz(tpr, fpr))
+
+
+def pr_auc(sweep: dict) -> float:
+    """
+    Area under the precision-recall curve computed as average precision (step-wise, no interpolation).
+    """
+    recall_steps = np.diff(np.r_[0.0, sweep["recall"]])
+    return float(np.sum(recall_steps * sweep["precision"]))
+
+
+def confusion_matrix_at(sweep: dict, threshold: float) -> dict:
+    """
+    Returns the confusion matrix at the given threshold reading it from the sweep,
+    i.e. at the smallest swept threshold that is >= threshold.
+    """
+    # Le soglie sono in ordine decrescente: l'ultima soglia >= threshold è quella cercata.
+    index = np.searchsorted(-sweep["thresholds"], -threshold, side="right") - 1
+    if index < 0:
+        tp, fp = 0, 0
+        fn = int(sweep["tp"][-1])
+        tn = int(sweep["fp"][-1])
+    else:
+        tp, fp = int(sweep["tp"][index]), int(sweep["fp"][index])
+        fn, tn = int(sweep["fn"][index]), int(sweep["tn"][index])
+
+    total = tp + fp + fn + tn
+    precision = tp / (tp + fp) if tp + fp > 0 else 0.0
+    recall = tp / (tp + fn) if tp + fn > 0 else 0.0
+    return {
+        "threshold": float(threshold),
+        "tp": tp,
+        "fp": fp,
+        "fn": fn,
+        "tn": tn,
+        "accuracy": (tp + tn) / total if total > 0 else 0.0,
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0,
+    }
+
+
+def downsample_curve(sweep: dict) -> dict:
+    indexes = np.unique(np.linspace(0, sweep["thresholds"].size - 1, num=CURVE_POINTS).astype(np.int64))
+    return {
+        "thresholds": sweep["thresholds"][indexes].tolist(),
+        "precision": sweep["precision"][indexes].tolist(),
+        "recall": sweep["recall"][indexes].tolist(),
+        "fpr": sweep["fpr"][indexes].tolist(),
+    }
+
+
+def default_threshold() -> float:
+    """
+    Threshold on the dropout score used when no optimal threshold is available.
+    """
+    if cfg.PROBLEM_TYPE == "regression":
+        return regression_threshold()
+    return 0.5
+
+
+def regression_threshold() -> float:
+    """
+    Threshold used by the regression scoring path during training (bin_acc). With REGRESSION_THRESHOLD=auto, it is the
+    threshold selected on the validation set by the last run of the same JOB_NAME (0.6 if there is none): a first run
+    saves it in threshold.json, a follow-up run with the same JOB_NAME uses it.
+    """
+    if cfg.REGRESSION_THRESHOLD != "auto":
+        return float(cfg.REGRESSION_THRESHOLD)
+
+    threshold_path = path.join(cfg.RESULTS_FOLDER, THRESHOLD_FILE_NAME)
+    if not path.exists(threshold_path):
+        return 0.6
+    with open(threshold_path) as threshold_file:
+        return float(json.load(threshold_file)["threshold"])
+
+
+def best_f1_threshold(sweep: dict) -> float:
+    return float(sweep["thresholds"][int(np.argmax(sweep["f1"]))])
+
+
+def evaluate_validation(model: tf.keras.Model, features: Union[dict, pd.DataFrame], target: np.ndarray,
+                        labels: np.ndarray) -> dict:
+    """
+    Evaluates the model on the validation set: returns loss, ROC-AUC and PR-AUC (validation_loss, validation_roc_auc,
+    validation_pr_auc) and the threshold maximizing F1 (validation_threshold). Choices between models and thresholds
+    should be made on these metrics, so that the test set is used only to report the chosen one.
+    labels is the DROPOUT column (1 = DROPOUT) of the validation set.
+    """
+    predictions = predict_full(model, features)
+    sweep = threshold_sweep(np.asarray(labels), dropout_scores(predictions))
+    return {
+        "validation_loss": compute_loss(np.asarray(target), predictions),
+        "validation_roc_auc": roc_auc(sweep),
+        "validation_pr_auc": pr_auc(sweep),
+        "validation_threshold": best_f1_threshold(sweep),
+    }
+
+
+def save_threshold(threshold: float):
+    """
+    Saves the threshold selected on the validation set, read by REGRESSION_THRESHOLD=auto in the next runs.
+    """
+    makedirs(cfg.RESULTS_FOLDER, exist_ok=True)
+    with open(path.join(cfg.RESULTS_FOLDER, THRESHOLD_FILE_NAME), "w") as threshold_file:
+        json.dump({"job_name": cfg.JOB_NAME, "problem_type": cfg.PROBLEM_TYPE, "split": "validation",
+                   "threshold": threshold}, threshold_file, indent=2)
+
+
+def evaluate(model: tf.keras.Model, features: Union[dict, pd.DataFrame], target: np.ndarray, labels: np.ndarray,
+             validation: dict) -> dict:
+    """
+    Evaluates the model on the whole test set: predicts it once, then computes loss, ROC-AUC, PR-AUC and the confusion
+    matrices at the default threshold, at the threshold selected on the validation set (validation, the metrics
+    returned by evaluate_validation, also copied in the report) and at the threshold maximizing F1 on the test set itself.
+    The last one is chosen on the test set, so its scores are an optimistic upper bound, not an estimate.
+    For regression with REGRESSION_THRESHOLD=auto, the default threshold is the one selected on the validation set by
+    this run, not the one of the previous run read by regression_threshold.
+    labels is the DROPOUT column (1 = DROPOUT) of the test set.
+    """
+    predictions = predict_full(model, features)
+    scores = dropout_scores(predictions)
+    sweep = threshold_sweep(np.asarray(labels), scores)
+
+    optimal_threshold = best_f1_threshold(sweep)
+    if cfg.PROBLEM_TYPE == "regression" and cfg.REGRESSION_THRESHOLD == "auto":
+        threshold = validation["validation_threshold"]
+    else:
+        threshold = default_threshold()
+
+    return {
+        "job_name": cfg.JOB_NAME,
+        "problem_type": cfg.PROBLEM_TYPE,
+        "records": int(scores.size),
+        "loss": compute_loss(np.asarray(target), predictions),
+        "roc_auc": roc_auc(sweep),
+        "pr_auc": pr_auc(sweep),
+        **validation,
+        "optimal_threshold": optimal_threshold,
+        "default": confusion_matrix_at(sweep, threshold),
+        "validation": confusion_matrix_at(sweep, validation["validation_threshold"]),
+        "optimal": confusion_matrix_at(sweep, optimal_threshold),
+        "curves": downsample_curve(sweep),
+    }
+
+
+def save_report(report: dict):
+    makedirs(cfg.RESULTS_FOLDER, exist_ok=True)
+    with open(path.join(cfg.RESULTS_FOLDER, REPORT_FILE_NAME), "w") as report_file:
+        json.dump(report, report_file, indent=2)
+
+
+def save_test_set(test_set: pd.DataFrame):
+    """
+    Saves the evaluated test set (features and targets), e.g. for feature_importance.py.
+    """
+    makedirs(cfg.RESULTS_FOLDER, exist_ok=True)
+    test_set.to_pickle(path.join(cfg.RESULTS_FOLDER, TEST_SET_FILE_NAME))
+
+
+def load_test_set() -> pd.DataFrame:
+    return pd.read_pickle(path.join(cfg.RESULTS_FOLDER, TEST_SET_FILE_NAME))
+
+
+def print_report(report: dict):
+    print('Results with validation dataset')
+    print('Loss:', round(report["validation_loss"], 4))
+    print('ROC-AUC:', round(report["validation_roc_auc"], 4))
+    print('PR-AUC:', round(report["validation_pr_auc"], 4))
+    print()
+    print('Results with test dataset')
+    print('Records:', report["records"])
+    print('Loss:', round(report["loss"], 4))
+    print('ROC-AUC:', round(report["roc_auc"], 4))
+    print('PR-AUC:', round(report["pr_auc"], 4))
+    for name, description in [("default", "default"), ("validation", "selected on the validation set"),
+                              ("optimal", "optimal on the test set, optimistic")]:
+        scores = report[name]
+        print()
+        print(f'Threshold ({description}):', round(scores["threshold"], 4))
+        print('Accuracy:', round(scores["accuracy"], 4))
+        print('False positives:', scores["fp"])
+        print('False negatives:', scores["fn"])
+        print('True positives:', scores["tp"])
+        print('True negatives:', scores["tn"])
+        print('Precision: ', round(scores["precision"], 4))
+        print('Recall: ', round(scores["recall"], 4))
+        print('F1: ', round(scores["f1"], 4))
@@ -0,0 +1,154 @@
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+import numpy as np
+import tensorflow as tf
+
+import evaluation
+import preprocessing
+import config as cfg
+
+"""
+Importanza delle feature per permutazione: per ogni feature (o gruppo di feature) i valori delle colonne vengono
+permutati fra i record del test set e si misura di quanto diminuisce la ROC-AUC del modello.
+Le colonne di un gruppo vengono permutate insieme, con la stessa permutazione.
+Invece di chiamare il modello una volta per ogni feature e ripetizione, molte copie permutate del test set vengono
+concatenate e predette con un'unica chiamata; la copia successiva viene preparata mentre il modello predice quella
+corrente.
+Richiede il modello e il test set salvati da invalsi.py (SAVE_TEST_SET=True) con gli stessi JOB_NAME e PROBLEM_TYPE.
+Va lanciato dalla cartella principale del repository, come invalsi.py.
+"""
+
+IMPORTANCE_FILE_NAME = "feature_importance.json"
+
+FEATURE_GROUPS = {
+    "ambiti": preprocessing.AMBITI,
+    "processi": preprocessing.PROCESSI,
+    "geography": ["Cod_reg", "Nome_reg", "Areageo_3", "Areageo_4", "Areageo_5", "Areageo_5_Istat",
+                  "cod_provincia_ISTAT", "sigla_provincia_istat"],
+    "school": ["CODICE_SCUOLA", "CODICE_PLESSO", "CODICE_CLASSE", "n_stud_prev", "n_classi_prev"],
+    "father": ["luogo_padre", "titolo_padre", "prof_padre"],
+    "mother": ["luogo_madre", "titolo_madre", "prof_madre"],
+    "grades": preprocessing.COLUMNS_LOW_RATIO_NULL_VALUES,
+    "scores": ["pu_ma_gr", "pu_ma_no", "pu_ma_no_corr", "WLE_MAT", "WLE_MAT_200", "WLE_MAT_200_CORR"],
+}
+
+
+def permutation_features(input_names: list) -> dict:
+    """
+    Returns the permuted features: every model input alone and every group of FEATURE_GROUPS
+    (restricted to the model inputs, e.g. without the columns removed by correlation pruning).
+    """
+    features = {name: [name] for name in input_names}
+    for group, columns in FEATURE_GROUPS.items():
+        columns = [col for col in columns if col in input_names]
+        if len(columns) > 1:
+            features[group] = columns
+    return features
+
+
+def stack_copies(columns: dict, copies: list) -> dict:
+    """
+    Concatenates one copy of columns for every (permuted columns, permutation) of copies.
+    """
+    stacked = {}
+    for name, values in columns.items():
+        stacked[name] = np.concatenate([values[permutation] if name in permuted else values
+                                        for permuted, permutation in copies])
+    return stacked
+
+
+def permutation_importance(model: tf.keras.Model, columns: dict, labels: np.ndarray, features: dict, repeats: int,
+                           max_batch_records: int, batch_size: int, seed: int = 19) -> dict:
+    """
+    Computes, for every feature of features (name -> permuted columns), the ROC-AUC decrease of the model
+    when the feature columns are permuted, for repeats different permutations.
+    At most max_batch_records records (test set copies) are predicted by each call of the model.
+    """
+    records = labels.size
+    rng = np.random.default_rng(seed)
+    copies = [(name, rng.permutation(records)) for _ in range(repeats) for name in features]
+    copies_per_call = max(1, max_batch_records // records)
+    chunks = [copies[start:start + copies_per_call] for start in range(0, len(copies), copies_per_call)]
+
+    baseline = evaluation.roc_auc(evaluation.threshold_sweep(
+        labels, evaluation.dropout_scores(evaluation.predict_full(model, columns, batch_size))))
+
+    drops = {name: [] for name in features}
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        def stack(chunk):
+            return stack_copies(columns, [(features[name], permutation) for name, permutation in chunk])
+
+        next_inputs = executor.submit(stack, chunks[0])
+        for index, chunk in enumerate(chunks):
+            inputs = next_inputs.result()
+            if index + 1 < len(chunks):
+                next_inputs = executor.submit(stack, chunks[index + 1])
+
+            predictions = evaluation.predict_full(model, inputs, batch_size)
+            del inputs
+            for copy, (name, _) in enumerate(chunk):
+                scores = evaluation.dropout_scores(predictions[copy * records:(copy + 1) * records])
+                drops[name].append(baseline - evaluation.roc_auc(evaluation.threshold_sweep(labels, scores)))
+            print(f"Predicted {min((index + 1) * copies_per_call, len(copies))}/{len(copies)} permuted copies")
+
+    importances = [{
+        "feature": name,
+        "columns": features[name],
+        "importance": float(np.mean(drops[name])),
+        "std": float(np.std(drops[name])),
+        "drops": [float(drop) for drop in drops[name]],
+    } for name in features]
+    importances.sort(key=lambda importance: importance["importance"], reverse=True)
+
+    return {
+        "job_name": cfg.JOB_NAME,
+        "problem_type": cfg.PROBLEM_TYPE,
+        "records": int(records),
+        "repeats": repeats,
+        "baseline_roc_auc": baseline,
+        "features": importances,
+    }
+
+
+def print_importances(report: dict):
+    print(f"Baseline ROC-AUC: {report['baseline_roc_auc']:.4f} ({report['records']:,} records, "
+          f"{report['repeats']} permutations per feature)")
+    print(f"{'Feature':<40}{'ROC-AUC drop':>14}{'Std':>10}")
+    for importance in report["features"]:
+        name = importance["feature"]
+        if len(importance["columns"]) > 1:
+            name += f" ({len(importance['columns'])} columns)"
+        print(f"{name:<40}{importance['importance']:>14.4f}{importance['std']:>10.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Computes the permutation feature importance of the model "
+                                                 "saved by invalsi.py (configured by JOB_NAME and PROBLEM_TYPE).")
+    parser.add_argument("--repeats", type=int, default=5, help="permutations of every feature")
+    parser.add_argument("--sample-rows", type=int, default=200_000,
+                        help="records of the test set used (0 uses every record)")
+    parser.add_argument("--max-batch-records", type=int, default=2_000_000,
+                        help="records (permuted copies of the test set) predicted by each call of the model")
+    parser.add_argument("--batch-size", type=int, default=65536)
+    arguments = parser.parse_args()
+
+    start = time.perf_counter()
+    model = tf.keras.models.load_model(path.join(cfg.RESULTS_FOLDER, "model"))
+    test_set = evaluation.load_test_set()
+    if 0 < arguments.sample_rows < len(test_set):
+        test_set = test_set.sample(arguments.sample_rows, random_state=19)
+
+    columns = {name: test_set[name].to_numpy() for name in model.input_names}
+    labels = test_set["DROPOUT"].to_numpy()
+    report = permutation_importance(model, columns, labels, permutation_features(model.input_names),
+                                    arguments.repeats, arguments.max_batch_records, arguments.batch_size)
+    with open(path.join(cfg.RESULTS_FOLDER, IMPORTANCE_FILE_NAME), "w") as importance_file:
+        json.dump(report, importance_file, indent=2)
+
+    print()
+    print_importances(report)
+    print(f"\nTotal time: {time.perf_counter() - start:.1f}s")
@@ -1,7 +1,8 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
-import re
+import sqlite3
 import sys
+from os import makedirs, path
 
 import pandas as pd
 import numpy as np
@@ -15,9 +16,17 @@ from tensorflow.python.keras.callbacks import ModelCheckpoint
 from imblearn.over_sampling import SMOTENC
 
 import save_plots
+import evaluation
+import preprocessing
+import partitioned_dataset
+import column_store
+import correlation
+import profiling
+import telemetry
+import run_registry
+import warm_start
 import config as cfg
-from mapping_domande_ambiti_processi import MAPPING_DOMANDE_AMBITI_PROCESSI
-from column_converters import COLUMN_CONVERTERS
+from column_converters import COLUMN_CONVERTERS, STRING_COLUMNS_DTYPES
 
 print("Deep learning model for predicting school dropout (with data from INVALSI)\n")
 
@@ -27,18 +36,32 @@ if cfg.check_config() > 0:
 
 cfg.print_config()
 
+# Registro delle esecuzioni (vedi run_registry.py): configurazione, metriche di ogni epoca e metriche sul test set.
+# Un errore del registro non deve interrompere il training: l'esecuzione semplicemente non viene registrata.
+run_id = None
+if cfg.RUN_REGISTRY:
+    try:
+        run_id = run_registry.start_run(cfg.config_dict())
+    except sqlite3.Error as error:
+        print(f"Run registry not available, the run is not registered: {error}")
+
+# Con più training in parallelo (vedi regional_training.py) ogni processo usa solo una parte dei core.
+if cfg.INTRA_OP_THREADS > 0:
+    tf.config.threading.set_intra_op_parallelism_threads(cfg.INTRA_OP_THREADS)
+
 """
 Impostazioni di esecuzione dello script
 """
-PRE_ML = False  # Esegue la parte di analisi ed elaborazione del dataset precedente quella di ML.
-SAVE_CLEANED_DATASET = False  # Salva il dataset ripulito dalle colonne non utili.
-CONVERT_DOMANDE_TO_AMBITI_PROCESSI = False  # Esegue la rimozione delle colonne con domande e le sostituisce con quelle di ambito e processo.
+PRE_ML = cfg.PRE_ML  # Esegue la parte di analisi ed elaborazione del dataset precedente quella di ML.
+SAVE_CLEANED_DATASET = cfg.SAVE_CLEANED_DATASET  # Salva il dataset ripulito dalle colonne non utili.
+CONVERT_DOMANDE_TO_AMBITI_PROCESSI = cfg.CONVERT_DOMANDE_TO_AMBITI_PROCESSI  # Esegue la rimozione delle colonne con domande e le sostituisce con quelle di ambito e processo.
 
 """
 Import del dataset originale
 """
 if PRE_ML:
-    original_dataset = pd.read_csv(cfg.ORIGINAL_DATASET, sep=';', converters=COLUMN_CONVERTERS)
+    with profiling.stage("read_original_dataset"):
+        original_dataset = pd.read_csv(cfg.ORIGINAL_DATASET, sep=';', converters=COLUMN_CONVERTERS)
 
 """
 Cerchiamo colonne che abbiamo percentuali di valori nulli.
@@ -51,13 +74,8 @@ if PRE_ML:
             print(col, '\t\tType: ', original_dataset[col].dtypes, '\tMissing values:',
                   original_dataset[col].isnull().mean().round(3))
 
-columns_high_ratio_null_values = ["codice_orario", "PesoClasse", "PesoScuola", "PesoTotale_Matematica"]
-columns_low_ratio_null_values = [
-    "voto_scritto_ita",  # 0.683
-    "voto_scritto_mat",  # 0.113
-    "voto_orale_ita",  # 0.683
-    "voto_orale_mat"  # 0.114
-]
+columns_high_ratio_null_values = preprocessing.COLUMNS_HIGH_RATIO_NULL_VALUES
+columns_low_ratio_null_values = preprocessing.COLUMNS_LOW_RATIO_NULL_VALUES
 
 """
 Cerchiamo colonne con valori univoci o quasi (ad esempio identificativi).
@@ -70,7 +88,7 @@ if PRE_ML:
         unique_vals = original_dataset[col].nunique()
         if unique_vals / dataset_len > 0.1:
             print(col, "ratio = ", round(unique_vals / dataset_len, 3))
-columns_with_unique_values = ["Unnamed: 0", "CODICE_STUDENTE"]
+columns_with_unique_values = preprocessing.COLUMNS_WITH_UNIQUE_VALUES
 
 """
 Cerchiamo colonne con sempre lo stesso valore perché non danno informazioni.
@@ -83,7 +101,7 @@ if PRE_ML:
         if unique_vals == 1:
             print(col)
 
-columns_with_just_one_value = ["macrotipologia", "livello"]
+columns_with_just_one_value = preprocessing.COLUMNS_WITH_JUST_ONE_VALUE
 
 """
 Rimozione delle colonne indicate in:
@@ -93,13 +111,12 @@ Rimozione delle colonne indicate in:
 - columns_with_just_one_value
 """
 if PRE_ML:
-    cleaned_original_dataset: pd.DataFrame = original_dataset.drop(
-        columns_high_ratio_null_values + columns_with_unique_values + columns_with_just_one_value, axis=1)
+    cleaned_original_dataset: pd.DataFrame = preprocessing.clean_original_dataset(original_dataset)
 
     if SAVE_CLEANED_DATASET:
         cleaned_original_dataset.to_csv(cfg.CLEANED_DATASET, index=False)
     else:
-        cleaned_original_dataset = pd.read_csv(cfg.CLEANED_DATASET)
+        cleaned_original_dataset = pd.read_csv(cfg.CLEANED_DATASET, dtype=STRING_COLUMNS_DTYPES)
 
     if "Unnamed: 0" in cleaned_original_dataset.columns:
         cleaned_original_dataset.drop("cleaned_original_dataset", axis=1, inplace=True)
@@ -109,15 +126,7 @@ Mapping domande -> (ambiti, processi)
 Tutte le colonne delle domande vengono sostituite da colonne ambiti e processi.
 """
 
-list_ambiti_processi = [AP for val in MAPPING_DOMANDE_AMBITI_PROCESSI.values() for AP in val]
-ambiti_processi = set(list_ambiti_processi)
-conteggio_ambiti_processi = {AP: list_ambiti_processi.count(AP) for AP in ambiti_processi}
-
-if PRE_ML:
-    dataset_with_ambiti_processi = cleaned_original_dataset.copy()
-    for AP in ambiti_processi:
-        # Aggiunge una colonna al dataset chiamata AP e inizializza tutti i record a 0.0.
-        dataset_with_ambiti_processi[AP] = 0.0
+ambiti_processi = set(preprocessing.AMBITI_PROCESSI)
 
 """
 Per ogni domanda vado a vedere se lo studente ha risposto correttamente o erroneamente:
@@ -125,30 +134,55 @@ Per ogni domanda vado a vedere se lo studente ha risposto correttamente o errone
 all'ambito o al processo. L'incremento è di 1/(#domande con quell'ambito o processo).
 - se ha risposto erroneamente, non incremento il valore.
 Di conseguenza uno studente che ha risposto sempre correttamente a domande di un certo ambito/processo avrà il valore di quella cella a 1.
+La conversione è vettorizzata (vedi preprocessing.py).
 """
+# Riepiloghi delle partizioni lette dal dataset partizionato, da cui vengono calcolati i valori di riempimento dei nulli.
+partitions_summary = None
 if PRE_ML and CONVERT_DOMANDE_TO_AMBITI_PROCESSI:
-    questions_columns = [col for col in list(cleaned_original_dataset) if re.search("^D\d", col)]
-
-    for i, row in dataset_with_ambiti_processi.iterrows():
-        for question, APs in MAPPING_DOMANDE_AMBITI_PROCESSI.items():
-            if row[question] is True:
-                for AP in APs:
-                    dataset_with_ambiti_processi.at[i, AP] += 1 / conteggio_ambiti_processi[AP]
-
-    dataset_ap = dataset_with_ambiti_processi.drop(questions_columns, axis=1)
+    with profiling.stage("convert_domande_to_ambiti_processi"):
+        dataset_ap = preprocessing.convert_domande_to_ambiti_processi(cleaned_original_dataset)
 
     dataset_ap.to_csv(cfg.CLEANED_DATASET_WITH_AP, index=False)
+elif cfg.COLUMN_STORE:
+    # Archivio a colonne condiviso dai training per regione (vedi regional_training.py):
+    # vengono letti solo i record della partizione indicata da PARTITION_FILTER.
+    with profiling.stage("read_dataset_ap"):
+        dataset_ap = column_store.read(cfg.COLUMN_STORE, cfg.PARTITION_FILTER)
+elif cfg.PARTITIONED_DATASET:
+    # Le nuove rilevazioni vengono aggiunte al dataset partizionato con partitioned_dataset.py (comando ingest).
+    # Se PARTITION_FILTER è sulla colonna di partizionamento vengono lette solo le partizioni selezionate.
+    partitions = partitioned_dataset.filter_partitions(cfg.PARTITIONED_DATASET, cfg.PARTITION_FILTER)
+    with profiling.stage("read_dataset_ap"):
+        dataset_ap = partitioned_dataset.load(cfg.PARTITIONED_DATASET, partitions)
+    # I riepiloghi descrivono esattamente i record selezionati solo se il filtro è sulla colonna di partizionamento:
+    # altrimenti i valori di riempimento vengono calcolati sui record filtrati, come senza dataset partizionato.
+    if partitions is not None:
+        partitions_summary = partitioned_dataset.dataset_summary(cfg.PARTITIONED_DATASET, partitions)
 else:
-    dataset_ap = pd.read_csv(cfg.CLEANED_DATASET_WITH_AP)
+    with profiling.stage("read_dataset_ap"):
+        dataset_ap = pd.read_csv(cfg.CLEANED_DATASET_WITH_AP, dtype=STRING_COLUMNS_DTYPES)
 
 if "Unnamed: 0" in dataset_ap.columns:
     dataset_ap.drop("Unnamed: 0", axis=1, inplace=True)
 
+"""
+Con PARTITION_FILTER ("colonna=valore") il modello viene addestrato solo sui record di una partizione,
+ad esempio una regione (Cod_reg=15).
+"""
+if cfg.PARTITION_FILTER and not cfg.COLUMN_STORE:
+    filter_column, filter_value = cfg.PARTITION_FILTER.split("=", 1)
+    dataset_ap = dataset_ap[dataset_ap[filter_column].astype(str) == filter_value].reset_index(drop=True)
+
+if cfg.PARTITION_FILTER:
+    print(f"Records with {cfg.PARTITION_FILTER}: {len(dataset_ap):,}")
+
 """
 Scopriamo se ci sono colonne con valori molto correlati.
 """
 if PRE_ML:
-    corr_matrix = dataset_ap.corr(method='pearson').round(2)
+    numeric_columns = list(dataset_ap.select_dtypes(include=[np.number, bool]).columns)
+    corr_matrix = correlation.blockwise_correlation(dataset_ap, numeric_columns,
+                                                    sample_rows=cfg.CORRELATION_SAMPLE_ROWS).round(2)
     corr_matrix.style.background_gradient(cmap='YlOrRd')
 
 interesting_to_check_if_correlated_columns = [
@@ -165,13 +199,29 @@ interesting_to_check_if_correlated_columns = [
                                              ] + list(ambiti_processi)
 
 if PRE_ML:
-    check_corr_dataset = dataset_ap[interesting_to_check_if_correlated_columns].corr(method='pearson').round(2)
+    check_corr_dataset = correlation.blockwise_correlation(dataset_ap, interesting_to_check_if_correlated_columns,
+                                                           sample_rows=cfg.CORRELATION_SAMPLE_ROWS).round(2)
     check_corr_dataset.style.background_gradient(cmap='YlOrRd')
 
 """
 Rimozione colonne con alta correlazione.
+Fra le feature continue (esclusi i voti, i cui valori nulli sono gestiti da FILL_NAN), per ogni coppia con correlazione
+in valore assoluto maggiore di CORRELATION_THRESHOLD viene rimossa la colonna che compare dopo nella lista
+(ad esempio WLE_MAT_200 e WLE_MAT_200_CORR rispetto a WLE_MAT).
 """
-# Sarà fatto?
+correlated_columns = []
+if cfg.PRUNE_CORRELATED_FEATURES:
+    pruning_candidates = ["pu_ma_gr", "pu_ma_no", "Fattore_correzione_new", "Cheating", "WLE_MAT", "WLE_MAT_200",
+                          "WLE_MAT_200_CORR", "pu_ma_no_corr"] + sorted(ambiti_processi)
+    with profiling.stage("correlation_pruning"):
+        candidates_correlation = correlation.blockwise_correlation(dataset_ap, pruning_candidates,
+                                                                   sample_rows=cfg.CORRELATION_SAMPLE_ROWS)
+        dropped_correlated_columns = correlation.correlated_features_to_drop(candidates_correlation,
+                                                                             cfg.CORRELATION_THRESHOLD)
+    correlation.print_pruning(dropped_correlated_columns, len(pruning_candidates))
+
+    correlated_columns = [col for col, _, _ in dropped_correlated_columns]
+    dataset_ap.drop(correlated_columns, axis=1, inplace=True)
 
 """
 Comprensione tipi colonne per trovare:
@@ -194,6 +244,7 @@ continuous_features = columns_low_ratio_null_values + \
 if cfg.FILL_NAN == "remove":
     continuous_features.remove("voto_scritto_ita")
     continuous_features.remove("voto_orale_ita")
+continuous_features = [col for col in continuous_features if col not in correlated_columns]
 ordinal_features = ["n_stud_prev", "n_classi_prev"]
 int_categorical_features = [
     "CODICE_SCUOLA", "CODICE_PLESSO", "CODICE_CLASSE", "campione", "prog",
@@ -210,28 +261,37 @@ bool_features = ["Pon"]
 Aggiustamento colonne con valori nulli.
 """
 
-dataset_ap["sigla_provincia_istat"].fillna(value="ND", inplace=True)
+with profiling.stage("fill_nan"):
+    dataset_ap["sigla_provincia_istat"].fillna(value="ND", inplace=True)
 
-if cfg.FILL_NAN == "remove":
-    # Rimuovere colonne voti ita.
-    # Rimuovere record con dati nulli in voti mat.
-    dataset_ap.drop(["voto_scritto_ita", "voto_orale_ita"], axis=1, inplace=True)
-    dataset_ap.dropna(subset=["voto_scritto_mat", "voto_orale_mat"], inplace=True)
-else:
-    for col in columns_low_ratio_null_values:
-        if cfg.FILL_NAN == "median":
-            replaced_value = dataset_ap[col].median()
-        else: # cfg.FILL_NAN == "mean"
-            replaced_value = dataset_ap[col].mean()
+    if cfg.FILL_NAN == "remove":
+        # Rimuovere colonne voti ita.
+        # Rimuovere record con dati nulli in voti mat.
+        dataset_ap.drop(["voto_scritto_ita", "voto_orale_ita"], axis=1, inplace=True)
+        dataset_ap.dropna(subset=["voto_scritto_mat", "voto_orale_mat"], inplace=True)
+    elif partitions_summary is not None:
+        dataset_ap.fillna(value=partitioned_dataset.fill_values(partitions_summary, columns_low_ratio_null_values,
+                                                                cfg.FILL_NAN), inplace=True)
+    else:
+        for col in columns_low_ratio_null_values:
+            if cfg.FILL_NAN == "median":
+                replaced_value = dataset_ap[col].median()
+            else: # cfg.FILL_NAN == "mean"
+                replaced_value = dataset_ap[col].mean()
 
-        dataset_ap[col].fillna(value=replaced_value, inplace=True)
+            dataset_ap[col].fillna(value=replaced_value, inplace=True)
 
 """Parte di creazione del modello"""
 
 """
 Suddivisione dataset in training, test.
+Le suddivisioni sono array di indici dei record di dataset_ap, così che i dati non vengano copiati per ogni insieme;
+train_test_split su np.arange seleziona gli stessi record che selezionerebbe sul DataFrame.
 """
-df_training_set, df_test_set = train_test_split(dataset_ap, test_size=cfg.TEST_SET_PERCENT, random_state=19)
+with profiling.stage("train_test_split"):
+    training_indexes, test_indexes = train_test_split(np.arange(len(dataset_ap)), test_size=cfg.TEST_SET_PERCENT,
+                                                      random_state=19)
+    dropout = dataset_ap["DROPOUT"].to_numpy(dtype=bool)
 
 """
 Verifica sbilanciamento classi DROPOUT e NO DROPOUT nel dataset.
@@ -251,112 +311,158 @@ if PRE_ML:
 """
 Sampling (random undersampling o SMOTE) su training set
 """
-if cfg.SAMPLING_TO_PERFORM == "random_undersampling":
-    # class_nodrop contiene i record della classe sovrarappresentata, ovvero SENZA DROPOUT.
-    class_nodrop = df_training_set[df_training_set['DROPOUT'] == False]
-    # class_drop contiene i record della classe sottorappresentata, ovvero CON DROPOUT.
-    class_drop = df_training_set[df_training_set['DROPOUT'] == True]
-
-    # Sotto campionamento di class_drop in modo che abbia stessa cardinalità di class_nodrop.
-    class_nodrop = class_nodrop.sample(len(class_drop), random_state=19)
-
-    print(f'Class NO DROPOUT: {len(class_nodrop):,}')
-    print(f'Classe DROPOUT: {len(class_drop):,}')
-
-    df_training_set = class_drop.append(class_nodrop)
-    df_training_set = df_training_set.sample(frac=1, random_state=19)
-else: # cfg.SAMPLING_TO_PERFORM == "SMOTENC"
-    categorical_features_indexes = [i for i in range(len(df_training_set.columns)) if
-                                    df_training_set.columns[i] in str_categorical_features + int_categorical_features]
-
-    df_training_set = df_training_set.apply(lambda col: pd.factorize(col)[0] if col.name in str_categorical_features else col)
-    df_test_set = df_test_set.apply(lambda col: pd.factorize(col)[0] if col.name in str_categorical_features else col)
-
-    sm = SMOTENC(categorical_features=categorical_features_indexes, random_state=19)
-    X_train, y_train = sm.fit_resample(
-        df_training_set[[col for col in df_training_set.columns if col != 'DROPOUT']],
-        df_training_set['DROPOUT']
-    )
-    df_training_set = pd.concat([X_train, y_train], axis=1)
-
-    X_test, y_test = sm.fit_resample(
-        df_test_set[[col for col in df_test_set.columns if col != 'DROPOUT']],
-        df_test_set['DROPOUT']
-    )
-    df_test_set = pd.concat([X_test, y_test], axis=1)
-
-    # Se SMOTENC viene eseguito, ogni feature categorica stringa viene trasformata in feature categorica intera.
-    int_categorical_features = int_categorical_features + str_categorical_features
-    str_categorical_features = []
-
-if "Unnamed: 0" in df_training_set.columns:
-    df_training_set.drop("Unnamed: 0", axis=1, inplace=True)
+with profiling.stage("sampling"):
+    if cfg.SAMPLING_TO_PERFORM == "random_undersampling":
+        # class_nodrop contiene i record della classe sovrarappresentata, ovvero SENZA DROPOUT.
+        class_nodrop = training_indexes[~dropout[training_indexes]]
+        # class_drop contiene i record della classe sottorappresentata, ovvero CON DROPOUT.
+        class_drop = training_indexes[dropout[training_indexes]]
+
+        # Sotto campionamento di class_drop in modo che abbia stessa cardinalità di class_nodrop.
+        # Le estrazioni sono le stesse di DataFrame.sample(n, random_state=19) e DataFrame.sample(frac=1, random_state=19).
+        class_nodrop = class_nodrop[np.random.RandomState(19).choice(len(class_nodrop), len(class_drop), replace=False)]
+
+        print(f'Class NO DROPOUT: {len(class_nodrop):,}')
+        print(f'Classe DROPOUT: {len(class_drop):,}')
+
+        training_indexes = np.concatenate([class_drop, class_nodrop])
+        training_indexes = training_indexes[np.random.RandomState(19).choice(len(training_indexes),
+                                                                             len(training_indexes), replace=False)]
+    else: # cfg.SAMPLING_TO_PERFORM == "SMOTENC"
+        df_training_set = dataset_ap.iloc[training_indexes]
+        df_test_set = dataset_ap.iloc[test_indexes]
+
+        categorical_features_indexes = [i for i in range(len(df_training_set.columns)) if
+                                        df_training_set.columns[i] in str_categorical_features + int_categorical_features]
+
+        df_training_set = df_training_set.apply(lambda col: pd.factorize(col)[0] if col.name in str_categorical_features else col)
+        df_test_set = df_test_set.apply(lambda col: pd.factorize(col)[0] if col.name in str_categorical_features else col)
+
+        sm = SMOTENC(categorical_features=categorical_features_indexes, random_state=19)
+        X_train, y_train = sm.fit_resample(
+            df_training_set[[col for col in df_training_set.columns if col != 'DROPOUT']],
+            df_training_set['DROPOUT']
+        )
+        df_training_set = pd.concat([X_train, y_train], axis=1)
+
+        X_test, y_test = sm.fit_resample(
+            df_test_set[[col for col in df_test_set.columns if col != 'DROPOUT']],
+            df_test_set['DROPOUT']
+        )
+        df_test_set = pd.concat([X_test, y_test], axis=1)
+
+        # Se SMOTENC viene eseguito, ogni feature categorica stringa viene trasformata in feature categorica intera.
+        int_categorical_features = int_categorical_features + str_categorical_features
+        str_categorical_features = []
+
+        # SMOTENC crea nuovi record: training set e test set vengono riuniti in un solo DataFrame,
+        # così che le fasi successive usino gli indici come con il random undersampling.
+        dataset_ap = pd.concat([df_training_set, df_test_set], ignore_index=True)
+        training_indexes = np.arange(len(df_training_set))
+        test_indexes = np.arange(len(df_training_set), len(dataset_ap))
+        dropout = dataset_ap["DROPOUT"].to_numpy(dtype=bool)
+        del df_training_set, df_test_set, X_train, y_train, X_test, y_test
+
+"""
+Con TRAINING_SUBSAMPLE < 1 il modello viene addestrato su un sottoinsieme stratificato (rispetto a DROPOUT)
+del training set, ad esempio per stimare le prestazioni con tutti i dati da una curva di apprendimento
+(vedi learning_curve.py). Il test set non cambia.
+"""
+if cfg.TRAINING_SUBSAMPLE < 1:
+    training_indexes, _ = train_test_split(training_indexes, train_size=cfg.TRAINING_SUBSAMPLE,
+                                           stratify=dropout[training_indexes], random_state=19)
+    print(f"Training subsample ({cfg.TRAINING_SUBSAMPLE:.0%}): {len(training_indexes):,} records")
 
 """
 Suddivisione dataset di training in training (più piccolo di quello di partenza), validation.
 """
-df_training_set, df_validation_set = train_test_split(df_training_set, test_size=cfg.VALIDATION_SET_PERCENT,
-                                                      random_state=19)
+training_indexes, validation_indexes = train_test_split(training_indexes, test_size=cfg.VALIDATION_SET_PERCENT,
+                                                        random_state=19)
 
 """
 Conversione da Pandas DataFrame a Tensorflow Dataset.
-"""
-
-
-def convert_dropout_column_to_one_hot(dropout_col):
-    dropout_col_one_hot = []
-    for dc in dropout_col:
-        if dc == 1:
-            dropout_col_one_hot.append([1, 0])
-        else:
-            dropout_col_one_hot.append([0, 1])
-    return dropout_col_one_hot
-
-
-def pd_dataframe_to_tf_dataset(dataframe: pd.DataFrame):
-    copied_df = dataframe.copy()
+Ogni colonna viene copiata una sola volta in un buffer contiguo: le feature continue in un'unica matrice float32,
+quelle intere e booleane in un'unica matrice int64 (una riga per colonna, così che ogni colonna sia contigua).
+I tensori vengono creati da questi buffer e ogni batch viene ottenuto con tf.gather sugli indici dei record.
+"""
+input_columns = [col for col in dataset_ap.columns if col not in ["DROPOUT", "LIVELLI"]]
+
+
+def column_buffers(dataframe: pd.DataFrame, columns: list) -> dict:
+    float_columns = [col for col in columns if col in continuous_features]
+    int_columns = [col for col in columns if col in ordinal_features + int_categorical_features + bool_features]
+
+    float_buffer = np.empty((len(float_columns), len(dataframe)), dtype=np.float32)
+    int_buffer = np.empty((len(int_columns), len(dataframe)), dtype=np.int64)
+    buffers = {}
+    for col in columns:
+        if col in float_columns:
+            buffer = float_buffer[float_columns.index(col)]
+        elif col in int_columns:
+            buffer = int_buffer[int_columns.index(col)]
+        else: # col in str_categorical_features
+            buffers[col] = dataframe[col].to_numpy(dtype=object)
+            continue
+        buffer[:] = dataframe[col].to_numpy()
+        buffers[col] = buffer
+    return buffers
+
+
+def target_buffer(dataframe: pd.DataFrame) -> np.ndarray:
     if cfg.PROBLEM_TYPE == "classification":
-        dropout_col = copied_df.pop("DROPOUT")
-        dropout_col = convert_dropout_column_to_one_hot(dropout_col)
-        copied_df.drop("LIVELLI", axis=1, inplace=True)
+        # One-hot: [1, 0] per DROPOUT, [0, 1] altrimenti.
+        dropout_col = dataframe["DROPOUT"].to_numpy(dtype=np.float32)
+        return np.stack([dropout_col, 1 - dropout_col], axis=-1)
     elif cfg.PROBLEM_TYPE == "regression":
         # Si invertono i valori della colonna target LIVELLI secondo la ratio (0 -> 5, 1 -> 4, ..., 5 -> 0),
         # per poi dividerli per 5, così da mapparli nel range [0,1].
         # Tale standardizzazione vien fatta affinché le predizioni restituite dal modello possano essere associate
-        # al concetto "Dropout Sì", nel caso siano > 0.6 o a "Dropout no" altrimenti.
-        dropout_col = copied_df.pop("LIVELLI")
-        dropout_col = dropout_col.subtract(5)
-        dropout_col = dropout_col.abs()
-        dropout_col = dropout_col.divide(5) # Normalizzazione dei valori della colonna da [0..5] a [0..1].
-        copied_df.drop("DROPOUT", axis=1, inplace=True)
+        # al concetto "Dropout Sì", nel caso siano > REGRESSION_THRESHOLD o a "Dropout no" altrimenti.
+        return np.abs(dataframe["LIVELLI"].to_numpy(dtype=np.float32) - 5) / 5
     else: # cfg.PROBLEM_TYPE == "pure_regression"
-        dropout_col = copied_df.pop("LIVELLI")
-        dropout_col = dropout_col.divide(5) # Normalizzazione dei valori della colonna da [0..5] a [0..1].
-        copied_df.drop("DROPOUT", axis=1, inplace=True)
+        return dataframe["LIVELLI"].to_numpy(dtype=np.float32) / 5 # Normalizzazione dei valori della colonna da [0..5] a [0..1].
+
 
+def gather_matrix(columns: list, indexes: np.ndarray) -> np.ndarray:
     """
-    Dato che il dataframe ha dati eterogenei lo convertiamo a dizionario (i.e. dict(copied_df)),
-    in cui le chiavi sono i nomi delle colonne e i valori sono i valori della colonna.
-    Infine bisogna indicare la colonna target.
+    Returns the float32 matrix of the records indexes for columns, sorted by name like stack_dict.
     """
+    matrix = np.empty((len(indexes), len(columns)), dtype=np.float32)
+    for i, col in enumerate(sorted(columns)):
+        matrix[:, i] = features_buffers[col][indexes]
+    return matrix
 
-    tf_dataset = tf.data.Dataset.from_tensor_slices((dict(copied_df), dropout_col))
-    tf_dataset = tf_dataset.shuffle(buffer_size=len(copied_df), seed=19)
-    return tf_dataset
 
+def indexes_to_tf_dataset(indexes: np.ndarray):
+    tf_dataset = tf.data.Dataset.from_tensor_slices(indexes)
+    tf_dataset = tf_dataset.shuffle(buffer_size=len(indexes), seed=19)
+    # drop_remainder=True rimuove i record che non rientrano nei batch della dimensione fissata.
+    tf_dataset = tf_dataset.batch(cfg.BATCH_SIZE, drop_remainder=True)
+    return tf_dataset.map(lambda batch: ({name: tf.gather(tensor, batch) for name, tensor in features_tensors.items()},
+                                         tf.gather(target_tensor, batch)),
+                          num_parallel_calls=tf.data.AUTOTUNE)
 
-ds_training_set = pd_dataframe_to_tf_dataset(df_training_set)
-ds_validation_set = pd_dataframe_to_tf_dataset(df_validation_set)
-ds_test_set = pd_dataframe_to_tf_dataset(df_test_set)
 
-"""
-Suddivisione dei Dataset in batch per sfruttare meglio le capacità hardware
-(invece di elaborare un record per volta).
-"""
-# drop_remainder=True rimuove i record che non rientrano nei batch della dimensione fissata.
-ds_training_set = ds_training_set.batch(cfg.BATCH_SIZE, drop_remainder=True)
-ds_validation_set = ds_validation_set.batch(cfg.BATCH_SIZE, drop_remainder=True)
-ds_test_set = ds_test_set.batch(cfg.BATCH_SIZE, drop_remainder=True)
+with profiling.stage("pd_dataframe_to_tf_dataset"):
+    features_buffers = column_buffers(dataset_ap, input_columns)
+    target_values = target_buffer(dataset_ap)
+    if cfg.SAVE_TEST_SET:
+        df_test_set = dataset_ap.iloc[test_indexes]
+    # Da qui in poi i dati vengono letti solo dai buffer.
+    del dataset_ap
+
+    features_tensors = {name: tf.convert_to_tensor(values) for name, values in features_buffers.items()}
+    target_tensor = tf.convert_to_tensor(target_values)
+
+    # Suddivisione dei Dataset in batch per sfruttare meglio le capacità hardware
+    # (invece di elaborare un record per volta).
+    ds_training_set = indexes_to_tf_dataset(training_indexes)
+    ds_validation_set = indexes_to_tf_dataset(validation_indexes)
+    # Il test set non viene suddiviso qui: la valutazione predice tutti i suoi record (vedi evaluation.py).
+
+print(f"Training set: {len(training_indexes):,} records - Validation set: {len(validation_indexes):,} records - "
+      f"Test set: {len(test_indexes):,} records")
+print(f"Peak memory after data preparation: {telemetry.peak_rss_mb():,.0f} MB")
 
 """
 Creazione layer di input per ogni feature a partire dalle liste precedentemente definite:
@@ -367,10 +473,7 @@ Creazione layer di input per ogni feature a partire dalle liste precedentemente
 - bool_features
 """
 input_layers = {}
-for name, column in df_training_set.items():
-    if name in ["DROPOUT", "LIVELLI"]:
-        continue
-
+for name in input_columns:
     if cfg.FILL_NAN == "remove" and name in ["voto_scritto_ita", "voto_orale_ita"]:
         continue
 
@@ -410,7 +513,8 @@ for name in ordinal_features:
     ordinal_inputs[name] = input_layers[name]
 
 normalizer = Normalization(axis=-1)
-normalizer.adapt(stack_dict(dict(df_training_set[ordinal_features])))
+with profiling.stage("normalizer_adapt"):
+    normalizer.adapt(gather_matrix(ordinal_features, training_indexes))
 ordinal_inputs = stack_dict(ordinal_inputs)
 ordinal_normalized = normalizer(ordinal_inputs)
 preprocessed_features.append(ordinal_normalized)
@@ -423,14 +527,22 @@ for name in continuous_features:
     continuous_inputs[name] = input_layers[name]
 
 normalizer = Normalization(axis=-1)
-normalizer.adapt(stack_dict(dict(df_training_set[continuous_features])))
+with profiling.stage("normalizer_adapt"):
+    normalizer.adapt(gather_matrix(continuous_features, training_indexes))
 continuous_inputs = stack_dict(continuous_inputs)
 continuous_normalized = normalizer(continuous_inputs)
 preprocessed_features.append(continuous_normalized)
 
+# Vocabolari delle feature categoriche, salvati nella firma del preprocessore (vedi warm_start.py).
+# Anche con il dataset partizionato vengono calcolati sul solo training set: i vocabolari dei riepiloghi delle partizioni
+# conterrebbero anche le categorie presenti solo nel test set.
+vocabularies = {}
+
 # Preprocessing colonne con dati categorici stringa
 for name in str_categorical_features:
-    vocab = sorted(set(df_training_set[name]))
+    with profiling.stage("build_vocabularies"):
+        vocab = np.unique(features_buffers[name][training_indexes]).tolist()
+        vocabularies[name] = vocab
 
     lookup = StringLookup(vocabulary=vocab, output_mode='one_hot')
 
@@ -441,7 +553,9 @@ for name in str_categorical_features:
 
 # Preprocessing colonne con dati categorici interi
 for name in int_categorical_features:
-    vocab = sorted(set(df_training_set[name]))
+    with profiling.stage("build_vocabularies"):
+        vocab = np.unique(features_buffers[name][training_indexes]).tolist()
+        vocabularies[name] = vocab
 
     lookup = IntegerLookup(vocabulary=vocab, output_mode='one_hot')
 
@@ -456,14 +570,25 @@ Assemblaggio dei vari layer preprocessati.
 
 preprocessed = tf.concat(preprocessed_features, axis=-1)
 
-preprocessor = tf.keras.Model(input_layers, preprocessed)
+preprocessor = tf.keras.Model(input_layers, preprocessed, name="preprocessor")
+
+# Due esecuzioni possono condividere i pesi (WARM_START_FROM) solo se i loro preprocessori hanno la stessa firma.
+preprocessor_signature = {
+    "inputs": {name: input_layers[name].dtype.name for name in sorted(input_layers)},
+    # Ordine delle feature nell'output del preprocessore.
+    "features": bool_features + sorted(ordinal_features) +
+                sorted(name for name in continuous_features if name in input_layers) +
+                str_categorical_features + int_categorical_features,
+    "vocabularies": vocabularies,
+    "width": int(preprocessor.output_shape[-1]),
+}
 
 # inizializzatore che verrà usato per i pesi dei layer con ReLU / LeakyReLU
 initializer_hidden_layer = tf.keras.initializers.HeNormal(seed=19)
 # inizializzatore che verrà usato per i pesi dei layer con sigmoid
 initializer_output_layer = tf.keras.initializers.GlorotNormal(seed=19)
 
-body = tf.keras.Sequential()
+body = tf.keras.Sequential(name="body")
 
 if cfg.DROPOUT_LAYER:
     body.add(tf.keras.layers.Dropout(rate=cfg.DROPOUT_INPUT_LAYER_RATE, seed=19))  # aggiunta dropout a layer di input
@@ -501,12 +626,20 @@ result = body(x)
 
 model = tf.keras.Model(input_layers, result)
 
+"""
+Avvio a caldo: i pesi di body vengono inizializzati con quelli di un'esecuzione precedente compatibile.
+"""
+warm_started = False
+if cfg.WARM_START_FROM:
+    warm_started = warm_start.warm_start(body, preprocessor_signature)
+
 if cfg.PROBLEM_TYPE == "classification":
     main_metric = tf.keras.metrics.Accuracy(name="acc")
     loss_function = tf.keras.losses.CategoricalCrossentropy()
 elif cfg.PROBLEM_TYPE == "regression":
-    # 0.6 perché dopo il preprocessing, i LIVELLI in [3,4,5] è DROPOUT = True, LIVELLI in [0,1,2] è DROPOUT = False
-    main_metric = tf.keras.metrics.BinaryAccuracy(name="bin_acc", threshold=0.6)  
+    # 0.6 di default perché dopo il preprocessing, i LIVELLI in [3,4,5] è DROPOUT = True, LIVELLI in [0,1,2] è DROPOUT = False.
+    # Con REGRESSION_THRESHOLD=auto si usa la soglia scelta sul validation set dall'ultima esecuzione dello stesso JOB_NAME.
+    main_metric = tf.keras.metrics.BinaryAccuracy(name="bin_acc", threshold=evaluation.regression_threshold())
     loss_function = tf.keras.losses.BinaryCrossentropy()
 else: # cfg.PROBLEM_TYPE == "pure_regression"
     main_metric = tf.keras.metrics.MeanAbsoluteError(name="mae")
@@ -536,36 +669,80 @@ early_stopper = EarlyStopping(monitor="val_loss",
 """
 Definizione della callback che permette durante il training di salvare il miglior modello calcolato.
 """
-model_checkpoint = ModelCheckpoint("best_" + cfg.PROBLEM_TYPE + ".h5", monitor='val_loss', mode='min', save_best_only=True)
+makedirs(cfg.RESULTS_FOLDER, exist_ok=True)
+model_checkpoint = ModelCheckpoint(path.join(cfg.RESULTS_FOLDER, "best_" + cfg.PROBLEM_TYPE + ".h5"),
+                                   monitor='val_loss', mode='min', save_best_only=True)
+
+callbacks = ([early_stopper] if cfg.EARLY_STOPPING else []) + [model_checkpoint]
+
+"""
+Definizione della callback che registra throughput e uso delle risorse durante il training (vedi telemetry.py).
+"""
+if cfg.TELEMETRY:
+    resource_monitor = telemetry.ResourceMonitor(cfg.BATCH_SIZE, cfg.TELEMETRY_STEPS, preprocessor)
+    ds_training_set = resource_monitor.instrument_dataset(ds_training_set)
+    callbacks.append(resource_monitor)
+
+if run_id is not None:
+    callbacks.append(telemetry.RegistryRecorder(run_id))
+
+callbacks += profiling.trace_callbacks()
 
 print("[Training]")
-history = model.fit(ds_training_set,
-                    epochs=cfg.EPOCH,
-                    batch_size=cfg.BATCH_SIZE,
-                    validation_data=ds_validation_set,
-                    callbacks=([early_stopper] if cfg.EARLY_STOPPING else []) + [model_checkpoint],
-                    verbose=2)
-
-metrics = history.history
-save_plots.plot_main_metric(metrics)
-save_plots.plot_loss(metrics)
-save_plots.plot_tp(metrics)
-save_plots.plot_tn(metrics)
-save_plots.plot_fp(metrics)
-save_plots.plot_fn(metrics)
-save_plots.plot_recall(metrics)
-save_plots.plot_precision(metrics)
+with profiling.stage("training", profile=False):
+    history = model.fit(ds_training_set,
+                        epochs=cfg.EPOCH,
+                        batch_size=cfg.BATCH_SIZE,
+                        validation_data=ds_validation_set,
+                        callbacks=callbacks,
+                        verbose=2)
+
+# Il modello viene salvato (formato SavedModel) insieme ai risultati del job, ad esempio per il predittore per regione
+# (vedi regional_training.py).
+model.save(path.join(cfg.RESULTS_FOLDER, "model"))
+# Pesi e firma del preprocessore per l'avvio a caldo di esecuzioni successive (WARM_START_FROM).
+warm_start.save(body, preprocessor_signature)
+
+# Il confronto ha senso solo se i pesi sono stati effettivamente trasferiti.
+if warm_started:
+    warm_start.print_time_to_target(history.history, resource_monitor.epoch_times if cfg.TELEMETRY else [])
+
+if cfg.PRUNE_CORRELATED_FEATURES:
+    correlation.print_savings(len(correlated_columns), int(preprocessor.output_shape[-1]), cfg.NEURONS,
+                              cfg.NUMBER_OF_LAYERS, 2 if cfg.PROBLEM_TYPE == "classification" else 1,
+                              float(np.mean(resource_monitor.epoch_times)) if cfg.TELEMETRY else None)
+
+# I grafici vengono generati in un processo separato, in parallelo alla valutazione.
+plots_process = save_plots.render_in_background(history.history)
 
 print("[Test]")
-score = model.evaluate(ds_test_set, verbose=2)
+test_features = {name: values[test_indexes] for name, values in features_buffers.items()}
+with profiling.stage("evaluation", profile=False):
+    # La soglia viene scelta sul validation set: scegliendola sul test set le metriche sarebbero ottimistiche.
+    validation = evaluation.evaluate_validation(
+        model, {name: values[validation_indexes] for name, values in features_buffers.items()},
+        target_values[validation_indexes], dropout[validation_indexes])
+    report = evaluation.evaluate(model, test_features, target_values[test_indexes], dropout[test_indexes],
+                                 validation)
+evaluation.save_report(report)
+evaluation.save_threshold(validation["validation_threshold"])
+if run_id is not None:
+    try:
+        run_registry.finish_run(run_id, {**run_registry.report_metrics(report),
+                                         **run_registry.history_metrics(history.history)})
+    except sqlite3.Error as error:
+        print(f"Run registry not available, the final metrics are not registered: {error}")
+if cfg.SAVE_TEST_SET:
+    # Usato, insieme al modello salvato, per calcolare l'importanza delle feature (vedi feature_importance.py).
+    evaluation.save_test_set(df_test_set)
 
 print()
-print('Results with test dataset')
-print('Loss:', round(score[0], 4))
-print('Accuracy:', round(score[1], 4))
-print('False positives:', int(score[2]))
-print('False negatives:', int(score[3]))
-print('True positives:', int(score[4]))
-print('True negatives:', int(score[5]))
-print('Precision: ', round(score[6], 4))
-print('Recall: ', round(score[7], 4))
+evaluation.print_report(report)
+
+plots_process.wait()
+
+if cfg.PROFILING:
+    print()
+    print("[Profiling]")
+    profiling.print_summary()
+    profiling.save_profiles()
@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import makedirs, path
+
+import numpy as np
+
+from sbatch_config import read_sbatch_config
+
+"""
+Modalità di iterazione veloce: ogni configurazione (un file .sbatch di slurm/, di cui vengono lette le righe export)
+viene addestrata su sottoinsiemi stratificati del training set di dimensione crescente (TRAINING_SUBSAMPLE).
+Dall'errore sul validation set (1 - ROC-AUC, 1 - PR-AUC o la loss) viene stimata una curva di apprendimento
+errore = b * frazione^(-c), una retta nel piano log-log, che viene estrapolata alla frazione 1 (tutti i dati).
+Le configurazioni vengono ordinate in base alla stima; con --validate le migliori vengono addestrate anche su tutti
+i dati, per misurare l'errore dell'estrapolazione. Il test set non viene usato per scegliere: la sua metrica viene
+riportata solo per le configurazioni addestrate su tutti i dati.
+Il report di un'esecuzione precedente viene riutilizzato solo se è stata avviata con la stessa configurazione
+(salvata in LEARNING_CURVE_FOLDER accanto al log).
+Va lanciato dalla cartella principale del repository, come invalsi.py.
+"""
+
+LEARNING_CURVE_FOLDER = path.join("src", "results", "learning_curve")
+DEFAULT_FRACTIONS = [0.05, 0.1, 0.25]
+
+
+def subsample_job_name(job_name: str, fraction: float) -> str:
+    return job_name if fraction == 1 else f"{job_name}_subsample{round(fraction * 100, 2):g}"
+
+
+def validation_metric(report: dict, metric: str) -> float:
+    return report[f"validation_{metric}"]
+
+
+def metric_error(value: float, metric: str) -> float:
+    # Le metriche AUC crescono con i dati: la curva viene stimata sulla distanza dal valore massimo.
+    return value if metric == "loss" else 1.0 - value
+
+
+def error_to_metric(error: float, metric: str) -> float:
+    return error if metric == "loss" else 1.0 - error
+
+
+def read_json(file_path: str) -> dict:
+    if not path.exists(file_path):
+        return None
+    with open(file_path) as json_file:
+        return json.load(json_file)
+
+
+def reusable(report: dict, run_config: dict, previous_config: dict) -> str:
+    """
+    Returns why the report of a previous run cannot be reused, or None if it can.
+    """
+    if report is None:
+        return "no report"
+    if previous_config is None:
+        return "configuration not recorded"
+    if previous_config != run_config:
+        changed = sorted(key for key in set(previous_config) | set(run_config)
+                         if previous_config.get(key) != run_config.get(key))
+        return f"configuration changed ({', '.join(changed)})"
+    if "validation_roc_auc" not in report:
+        return "no validation metrics"
+    return None
+
+
+def run_fraction(config: dict, fraction: float, rerun: bool) -> dict:
+    """
+    Runs invalsi.py with the configuration on a fraction of the training set and returns its evaluation report
+    (reusing the report of a previous run with the same configuration unless rerun).
+    """
+    job_name = subsample_job_name(config.get("JOB_NAME", "default"), fraction)
+    results_folder = path.join("src", "results", job_name, config.get("PROBLEM_TYPE", "classification"))
+    report_path = path.join(results_folder, "evaluation.json")
+    config_path = path.join(LEARNING_CURVE_FOLDER, f"{job_name}.config.json")
+    run_config = {**config, "JOB_NAME": job_name, "TRAINING_SUBSAMPLE": str(fraction)}
+
+    reason = "--rerun" if rerun else reusable(read_json(report_path), run_config, read_json(config_path))
+    if reason is None:
+        print(f"{job_name}: reusing the report of a previous run with the same configuration")
+        return read_json(report_path)
+
+    print(f"{job_name}: running ({reason})")
+    env = os.environ.copy()
+    env.update(run_config)
+    makedirs(LEARNING_CURVE_FOLDER, exist_ok=True)
+    if path.exists(config_path):
+        # Un'esecuzione interrotta non deve lasciare la configurazione precedente associata al report.
+        os.remove(config_path)
+    with open(path.join(LEARNING_CURVE_FOLDER, f"{job_name}.log"), "w") as log_file:
+        exit_code = subprocess.call([sys.executable, path.join("src", "invalsi.py")], env=env,
+                                    stdout=log_file, stderr=subprocess.STDOUT)
+    if exit_code != 0 or not path.exists(report_path):
+        print(f"{job_name} failed (exit code {exit_code})")
+        return None
+    with open(config_path, "w") as config_file:
+        json.dump(run_config, config_file, indent=2)
+    return read_json(report_path)
+
+
+def fit_power_law(fractions: np.ndarray, errors: np.ndarray) -> tuple:
+    """
+    Fits error = b * fraction^(-c) with least squares on log(error) = log(b) - c * log(fraction).
+    Returns (b, c).
+    """
+    slope, intercept = np.polyfit(np.log(fractions), np.log(errors), deg=1)
+    return float(np.exp(intercept)), float(-slope)
+
+
+def learning_curve(name: str, config: dict, fractions: list, metric: str, rerun: bool) -> dict:
+    points = []
+    for fraction in fractions:
+        report = run_fraction(config, fraction, rerun)
+        if report is not None:
+            value = validation_metric(report, metric)
+            points.append({"fraction": fraction, "metric": value, "error": metric_error(value, metric)})
+
+    curve = {"name": name, "config": config, "metric": metric, "points": points, "predicted": None}
+    valid_points = [point for point in points if point["error"] > 0]
+    if len(valid_points) >= 2:
+        b, c = fit_power_law(np.array([point["fraction"] for point in valid_points]),
+                             np.array([point["error"] for point in valid_points]))
+        # Con tutti i dati la frazione è 1, quindi l'errore stimato è b.
+        curve.update({"b": b, "c": c, "predicted": error_to_metric(b, metric)})
+    return curve
+
+
+def rank(curves: list, metric: str) -> list:
+    estimated = [curve for curve in curves if curve["predicted"] is not None]
+    return sorted(estimated, key=lambda curve: curve["predicted"], reverse=metric != "loss")
+
+
+def validate(curves: list, metric: str, rerun: bool):
+    """
+    Trains the configurations of curves on the whole training set and records the error of the extrapolation
+    (on the validation set) and the metric on the test set, reported but not used for the ranking.
+    """
+    for curve in curves:
+        report = run_fraction(curve["config"], 1, rerun)
+        if report is not None:
+            curve["actual"] = validation_metric(report, metric)
+            curve["extrapolation_error"] = curve["predicted"] - curve["actual"]
+            curve["test"] = report[metric]
+
+
+def print_ranking(curves: list, fractions: list, metric: str):
+    header = "".join(f"{fraction:>14.0%}" for fraction in fractions)
+    print(f"Validation {metric} (test {metric} only for the configurations trained on all the data)")
+    print(f"{'Configuration':<40}{header}{'Predicted':>11}{'Actual':>9}{'Error':>9}{'Test':>9}")
+    for curve in curves:
+        values = {point["fraction"]: point["metric"] for point in curve["points"]}
+        row = "".join(f"{values[fraction]:>14.4f}" if fraction in values else f"{'-':>14}" for fraction in fractions)
+        if "actual" in curve:
+            actual = f"{curve['actual']:>9.4f}{curve['extrapolation_error']:>+9.4f}{curve['test']:>9.4f}"
+        else:
+            actual = f"{'-':>9}{'-':>9}{'-':>9}"
+        print(f"{curve['name']:<40}{row}{curve['predicted']:>11.4f}{actual}")
+
+    validated = [curve["extrapolation_error"] for curve in curves if "actual" in curve]
+    if validated:
+        print(f"Mean absolute extrapolation error of validation {metric} on {len(validated)} full runs: "
+              f"{np.mean(np.abs(validated)):.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ranks configurations by the performance extrapolated from "
+                                                 "training on stratified subsamples of the training set.")
+    parser.add_argument("sbatch_files", nargs="+", help="sbatch files with the configurations (export lines)")
+    parser.add_argument("--fractions", type=lambda fractions: [float(f) for f in fractions.split(",")],
+                        default=DEFAULT_FRACTIONS, help="comma separated list of training set fractions")
+    parser.add_argument("--metric", choices=["roc_auc", "pr_auc", "loss"], default="roc_auc",
+                        help="metric on the validation set used to fit the curves and rank the configurations")
+    parser.add_argument("--validate", type=int, default=0,
+                        help="number of best ranked configurations trained on the whole training set")
+    parser.add_argument("--workers", type=int, default=1, help="configurations trained at the same time")
+    parser.add_argument("--rerun", action="store_true",
+                        help="does not reuse the reports of previous runs, even with the same configuration")
+    arguments = parser.parse_args()
+
+    if any(fraction <= 0 or fraction >= 1 for fraction in arguments.fractions):
+        parser.error("fractions should be in range (0..1)")
+
+    start = time.perf_counter()
+    configs = {path.splitext(path.relpath(file_path, "slurm"))[0]: read_sbatch_config(file_path)
+               for file_path in arguments.sbatch_files}
+    with ThreadPoolExecutor(max_workers=arguments.workers) as executor:
+        curves = list(executor.map(lambda item: learning_curve(item[0], item[1], sorted(arguments.fractions),
+                                                               arguments.metric, arguments.rerun),
+                                   configs.items()))
+    ranking = rank(curves, arguments.metric)
+    subsample_time = time.perf_counter() - start
+
+    if arguments.validate > 0:
+        validate(ranking[:arguments.validate], arguments.metric, arguments.rerun)
+
+    makedirs(LEARNING_CURVE_FOLDER, exist_ok=True)
+    with open(path.join(LEARNING_CURVE_FOLDER, f"learning_curve_{arguments.metric}.json"), "w") as curves_file:
+        json.dump(curves, curves_file, indent=2)
+
+    print()
+    print_ranking(ranking, sorted(arguments.fractions), arguments.metric)
+    print(f"Subsample runs: {subsample_time:.0f}s, total: {time.perf_counter() - start:.0f}s")
+    for curve in curves:
+        if curve["predicted"] is None:
+            print(f"{curve['name']}: not enough successful runs to fit the learning curve")
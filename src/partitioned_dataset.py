@@ -0,0 +1,232 @@
+import argparse
+import hashlib
+import json
+import re
+from os import makedirs, path, replace
+
+import numpy as np
+import pandas as pd
+
+import preprocessing
+from column_converters import COLUMN_CONVERTERS, STRING_COLUMNS_DTYPES
+
+"""
+Dataset pulito e con ambiti e processi salvato in partizioni (una cartella per ogni valore di una colonna, ad esempio
+"anno" o "Cod_reg"), così che una nuova rilevazione INVALSI possa essere aggiunta senza rielaborare l'intero dataset.
+
+Per ogni partizione viene salvato nel manifest un riepilogo (numero di record e conteggio dei valori delle colonne con
+valori nulli): i valori usati per riempire i nulli dei record caricati si ottengono unendo i riepiloghi delle partizioni
+lette, senza rileggere i dati. I vocabolari dei layer di lookup invece vengono calcolati da invalsi.py sui soli record
+del training set, come senza dataset partizionato.
+
+Il manifest registra l'impronta di ogni rilevazione aggiunta, così che la stessa rilevazione non venga aggiunta due
+volte, e la dimensione in byte di ogni file di partizione: le righe scritte da un'aggiunta interrotta prima del
+salvataggio del manifest vengono ignorate in lettura e rimosse dall'aggiunta successiva.
+"""
+
+MANIFEST_FILE_NAME = "manifest.json"
+DATA_FILE_NAME = "data.csv"
+
+
+def read_manifest(root: str) -> dict:
+    manifest_path = path.join(root, MANIFEST_FILE_NAME)
+    if not path.exists(manifest_path):
+        return {"partition_column": None, "dtypes": {}, "partitions": {}, "waves": []}
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    manifest.setdefault("waves", [])
+    return manifest
+
+
+def write_manifest(root: str, manifest: dict):
+    # Scrittura atomica: il manifest viene sostituito solo quando è completo.
+    temporary_path = path.join(root, MANIFEST_FILE_NAME + ".tmp")
+    with open(temporary_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    replace(temporary_path, path.join(root, MANIFEST_FILE_NAME))
+
+
+def partition_folder(partition_column: str, value) -> str:
+    return f"{partition_column}={re.sub(r'[^0-9A-Za-z_.-]', '_', str(value))}"
+
+
+def python_value(value):
+    """
+    Converts numpy scalars to Python values that can be saved as JSON (NaN becomes None).
+    """
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def summarize(partition: pd.DataFrame) -> dict:
+    """
+    Computes the summary of a partition: number of records and value counts of the columns with null values to fill
+    (grades, which have few distinct values, so medians can be computed exactly from the counts).
+    """
+    value_counts = {}
+    for col in preprocessing.COLUMNS_LOW_RATIO_NULL_VALUES:
+        if col in partition.columns:
+            counts = partition[col].value_counts(dropna=True).sort_index()
+            value_counts[col] = [[python_value(value), int(count)] for value, count in counts.items()]
+
+    return {"rows": len(partition), "value_counts": value_counts}
+
+
+def merge_summaries(summaries: list) -> dict:
+    merged = {"rows": 0, "value_counts": {}}
+    for summary in summaries:
+        merged["rows"] += summary["rows"]
+        for col, counts in summary["value_counts"].items():
+            merged_counts = dict(map(tuple, merged["value_counts"].get(col, [])))
+            for value, count in counts:
+                merged_counts[value] = merged_counts.get(value, 0) + count
+            merged["value_counts"][col] = sorted([value, count] for value, count in merged_counts.items())
+    return merged
+
+
+def wave_hash(dataset_ap: pd.DataFrame) -> str:
+    """
+    Fingerprint of the content of a wave (values and column names, not the index).
+    """
+    digest = hashlib.sha256(pd.util.hash_pandas_object(dataset_ap, index=False).to_numpy().tobytes())
+    digest.update(json.dumps(list(map(str, dataset_ap.columns))).encode())
+    return digest.hexdigest()
+
+
+def append_partitions(dataset_ap: pd.DataFrame, root: str, partition_column: str, wave_name: str = ""):
+    """
+    Appends the records of dataset_ap (a new wave, e.g. a year of tests) to the partitioned dataset in root, creating
+    the missing partitions. Only the partitions receiving new records are written and summarized again.
+    Raises ValueError if the same wave was already appended.
+    """
+    makedirs(root, exist_ok=True)
+    manifest = read_manifest(root)
+    if manifest["partition_column"] not in [None, partition_column]:
+        raise ValueError(f"{root} is partitioned by {manifest['partition_column']}, not by {partition_column}.")
+    fingerprint = wave_hash(dataset_ap)
+    for wave in manifest["waves"]:
+        if wave["hash"] == fingerprint:
+            raise ValueError(f"{wave_name or 'This wave'} was already added to {root} (as {wave['name']}).")
+    manifest["partition_column"] = partition_column
+    if not manifest["dtypes"]:
+        manifest["dtypes"] = {col: str(dtype) for col, dtype in dataset_ap.dtypes.items()}
+    columns = list(manifest["dtypes"].keys())
+
+    for value, partition in dataset_ap.groupby(partition_column, sort=True):
+        key = str(python_value(value))
+        folder = partition_folder(partition_column, value)
+        makedirs(path.join(root, folder), exist_ok=True)
+
+        data_path = path.join(root, folder, DATA_FILE_NAME)
+        existing = manifest["partitions"].get(key)
+        if existing and "bytes" in existing:
+            # Le righe scritte da un'aggiunta interrotta, non descritte dal manifest, vengono rimosse.
+            with open(data_path, "r+b") as data_file:
+                data_file.truncate(existing["bytes"])
+        partition[columns].to_csv(data_path, mode="a" if existing else "w", header=not existing, index=False)
+
+        summary = summarize(partition)
+        if existing:
+            summary = merge_summaries([existing["summary"], summary])
+        manifest["partitions"][key] = {"folder": folder, "summary": summary, "bytes": path.getsize(data_path)}
+        print(f"Partition {partition_column}={key}: {summary['rows']:,} records")
+
+    manifest["waves"].append({"name": wave_name, "hash": fingerprint, "rows": len(dataset_ap)})
+    write_manifest(root, manifest)
+
+
+def load(root: str, partitions: list = None) -> pd.DataFrame:
+    """
+    Loads the given partitions (all of them by default) of the partitioned dataset in root,
+    with the column types recorded when the dataset was created. Only the records described by the manifest are read.
+    """
+    manifest = read_manifest(root)
+    keys = partitions if partitions is not None else sorted(manifest["partitions"].keys())
+    # I tipi numerici vengono dedotti da read_csv, quelli stringa e booleani vengono forzati: altrimenti una partizione
+    # con soli valori numerici in una colonna stringa (es. Cod_reg) avrebbe un tipo diverso dalle altre.
+    dtypes = {col: dtype for col, dtype in manifest["dtypes"].items() if dtype in ["object", "bool"]}
+    dtypes.update({col: str for col in manifest["dtypes"] if col in STRING_COLUMNS_DTYPES})
+    frames = [pd.read_csv(path.join(root, manifest["partitions"][key]["folder"], DATA_FILE_NAME), dtype=dtypes,
+                          nrows=manifest["partitions"][key]["summary"]["rows"])
+              for key in keys]
+    return pd.concat(frames, ignore_index=True)
+
+
+def filter_partitions(root: str, partition_filter: str) -> list:
+    """
+    Returns the keys of the partitions holding the records selected by partition_filter ("column=value", as
+    PARTITION_FILTER): all the partitions without a filter, None if the filter is not on the partition column
+    or no partition has the value.
+    """
+    manifest = read_manifest(root)
+    if not partition_filter:
+        return sorted(manifest["partitions"].keys())
+    column, value = partition_filter.split("=", 1)
+    if column != manifest["partition_column"]:
+        return None
+    return [value] if value in manifest["partitions"] else None
+
+
+def dataset_summary(root: str, partitions: list = None) -> dict:
+    """
+    Merges the summaries of the given partitions (all of them by default).
+    """
+    manifest = read_manifest(root)
+    keys = partitions if partitions is not None else manifest["partitions"].keys()
+    return merge_summaries([manifest["partitions"][key]["summary"] for key in keys])
+
+
+def fill_values(summary: dict, columns: list, method: str) -> dict:
+    """
+    Computes the median or mean of columns from the value counts of the summary, ignoring null values
+    (like pd.Series.median and pd.Series.mean).
+    """
+    values = {}
+    for col in columns:
+        counts = np.asarray(summary["value_counts"][col], dtype=np.float64)
+        if counts.size == 0:
+            continue
+        if method == "mean":
+            values[col] = float(np.sum(counts[:, 0] * counts[:, 1]) / np.sum(counts[:, 1]))
+        else: # method == "median"
+            cumulative = np.cumsum(counts[:, 1])
+            total = cumulative[-1]
+            # Con un numero pari di valori la mediana è la media dei due valori centrali.
+            lower = counts[np.searchsorted(cumulative, (total + 1) // 2), 0]
+            upper = counts[np.searchsorted(cumulative, total // 2 + 1), 0]
+            values[col] = float((lower + upper) / 2)
+    return values
+
+
+def ingest(original_dataset_path: str, root: str, partition_column: str):
+    """
+    Reads a new wave of the original dataset, cleans it, converts the questions to ambiti and processi
+    and appends it to the partitioned dataset.
+    """
+    original_dataset = pd.read_csv(original_dataset_path, sep=';', converters=COLUMN_CONVERTERS)
+    cleaned_dataset = preprocessing.clean_original_dataset(original_dataset)
+    append_partitions(preprocessing.convert_domande_to_ambiti_processi(cleaned_dataset), root, partition_column,
+                      path.basename(original_dataset_path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Appends records to the partitioned dataset.")
+    parser.add_argument("command", choices=["ingest", "import"],
+                        help="ingest: a new wave of the original dataset (';' separated, as ORIGINAL_DATASET); "
+                             "import: an already cleaned dataset with ambiti and processi (as CLEANED_DATASET_WITH_AP)")
+    parser.add_argument("file_path")
+    parser.add_argument("root", help="folder of the partitioned dataset")
+    parser.add_argument("--partition-column", default="anno")
+    arguments = parser.parse_args()
+
+    try:
+        if arguments.command == "ingest":
+            ingest(arguments.file_path, arguments.root, arguments.partition_column)
+        else:
+            dataset = pd.read_csv(arguments.file_path, dtype=STRING_COLUMNS_DTYPES)
+            if "Unnamed: 0" in dataset.columns:
+                dataset.drop("Unnamed: 0", axis=1, inplace=True)
+            append_partitions(dataset, arguments.root, arguments.partition_column, path.basename(arguments.file_path))
+    except ValueError as error:
+        parser.error(str(error))
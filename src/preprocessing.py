@@ -0,0 +1,55 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from mapping_domande_ambiti_processi import MAPPING_DOMANDE_AMBITI_PROCESSI
+
+"""
+Pulizia del dataset originale e conversione domande -> (ambiti, processi), condivise da invalsi.py
+e dal dataset partizionato (vedi partitioned_dataset.py).
+"""
+
+COLUMNS_HIGH_RATIO_NULL_VALUES = ["codice_orario", "PesoClasse", "PesoScuola", "PesoTotale_Matematica"]
+COLUMNS_LOW_RATIO_NULL_VALUES = [
+    "voto_scritto_ita",  # 0.683
+    "voto_scritto_mat",  # 0.113
+    "voto_orale_ita",  # 0.683
+    "voto_orale_mat"  # 0.114
+]
+COLUMNS_WITH_UNIQUE_VALUES = ["Unnamed: 0", "CODICE_STUDENTE"]
+COLUMNS_WITH_JUST_ONE_VALUE = ["macrotipologia", "livello"]
+
+list_ambiti_processi = [AP for val in MAPPING_DOMANDE_AMBITI_PROCESSI.values() for AP in val]
+AMBITI_PROCESSI = sorted(set(list_ambiti_processi))
+CONTEGGIO_AMBITI_PROCESSI = {AP: list_ambiti_processi.count(AP) for AP in AMBITI_PROCESSI}
+# Ogni domanda è associata a una coppia (ambito, processo).
+AMBITI = sorted(set(ambito for ambito, _ in MAPPING_DOMANDE_AMBITI_PROCESSI.values()))
+PROCESSI = sorted(set(processo for _, processo in MAPPING_DOMANDE_AMBITI_PROCESSI.values()))
+
+
+def clean_original_dataset(original_dataset: pd.DataFrame) -> pd.DataFrame:
+    """
+    Removes the columns with a high ratio of null values, (almost) unique values or just one value.
+    """
+    removed_columns = COLUMNS_HIGH_RATIO_NULL_VALUES + COLUMNS_WITH_UNIQUE_VALUES + COLUMNS_WITH_JUST_ONE_VALUE
+    return original_dataset.drop([col for col in removed_columns if col in original_dataset.columns], axis=1)
+
+
+def convert_domande_to_ambiti_processi(cleaned_dataset: pd.DataFrame) -> pd.DataFrame:
+    """
+    Replaces the question columns with one column for each ambito and processo: for every question answered correctly,
+    the value of each of its ambiti and processi is increased by 1/(#questions with that ambito or processo).
+    """
+    questions_columns = [col for col in cleaned_dataset.columns if re.search(r"^D\d", col)]
+
+    # weights[i, j] = 1/(#domande con l'ambito o processo j) se la domanda i ha l'ambito o processo j, altrimenti 0.
+    weights = np.zeros((len(MAPPING_DOMANDE_AMBITI_PROCESSI), len(AMBITI_PROCESSI)))
+    for i, APs in enumerate(MAPPING_DOMANDE_AMBITI_PROCESSI.values()):
+        for AP in APs:
+            weights[i, AMBITI_PROCESSI.index(AP)] = 1 / CONTEGGIO_AMBITI_PROCESSI[AP]
+
+    correct = (cleaned_dataset[list(MAPPING_DOMANDE_AMBITI_PROCESSI.keys())] == True).to_numpy(dtype=np.float64)
+    ambiti_processi = pd.DataFrame(correct @ weights, columns=AMBITI_PROCESSI, index=cleaned_dataset.index)
+
+    return pd.concat([cleaned_dataset.drop(questions_columns, axis=1), ambiti_processi], axis=1)
@@ -0,0 +1,119 @@
+import cProfile
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from os import makedirs, path
+
+import tensorflow as tf
+
+import config as cfg
+from telemetry import peak_rss_mb
+
+PROFILE_FOLDER = path.join(cfg.RESULTS_FOLDER, "profiles")
+SUMMARY_FILE_NAME = "stages.json"
+
+# Statistiche di ogni stage, nell'ordine in cui sono stati eseguiti la prima volta.
+stages = {}
+profilers = {}
+
+
+@contextmanager
+def stage(name: str, profile: bool = True):
+    """
+    Measures wall time and peak RSS of the wrapped code and, if profile and PROFILE_STAGES are True, collects its
+    cProfile statistics and its peak traced memory (tracemalloc). Does nothing if PROFILING is disabled.
+    cProfile and tracemalloc slow down Python code considerably (e.g. the converters called for every value when
+    reading the original dataset): with PROFILE_STAGES=False only the timings are collected, for every stage.
+    Entering again a stage with the same name accumulates its statistics. Stages must not be nested.
+    """
+    if not cfg.PROFILING:
+        yield
+        return
+
+    record = stages.setdefault(name, {"stage": name, "calls": 0, "wall_time": 0.0, "peak_traced_mb": 0.0})
+    profile = profile and cfg.PROFILE_STAGES
+    if profile:
+        profiler = profilers.setdefault(name, cProfile.Profile())
+        tracemalloc.start()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record["wall_time"] += time.perf_counter() - start
+        record["calls"] += 1
+        if profile:
+            profiler.disable()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            record["peak_traced_mb"] = max(record["peak_traced_mb"], peak / 2 ** 20)
+        record["peak_rss_mb"] = peak_rss_mb()
+
+
+def save_profiles():
+    """
+    Saves the raw cProfile statistics of every stage (viewable with pstats or snakeviz) and the stage summary.
+    """
+    if not cfg.PROFILING:
+        return
+
+    makedirs(PROFILE_FOLDER, exist_ok=True)
+    for name, profiler in profilers.items():
+        profiler.dump_stats(path.join(PROFILE_FOLDER, f"{name}.prof"))
+
+    with open(path.join(PROFILE_FOLDER, SUMMARY_FILE_NAME), "w") as summary_file:
+        json.dump(list(stages.values()), summary_file, indent=2)
+
+
+def print_summary():
+    if not cfg.PROFILING:
+        return
+
+    total = sum(record["wall_time"] for record in stages.values())
+    print(f"{'Stage':<32}{'Calls':>7}{'Time (s)':>12}{'%':>7}{'Traced peak (MB)':>18}{'Peak RSS (MB)':>15}")
+    for record in stages.values():
+        print(f"{record['stage']:<32}{record['calls']:>7}{record['wall_time']:>12.3f}"
+              f"{100 * record['wall_time'] / total if total > 0 else 0:>7.1f}"
+              f"{record['peak_traced_mb']:>18.1f}{record['peak_rss_mb']:>15.1f}")
+
+
+class TraceSteps(tf.keras.callbacks.Callback):
+    """
+    Captures a TensorFlow profiler trace (viewable with TensorBoard) of the training steps in [first_step, last_step],
+    counted from the beginning of training across epochs.
+    """
+
+    def __init__(self, first_step: int, last_step: int):
+        super().__init__()
+        self.first_step = first_step
+        self.last_step = last_step
+        self.step = 0
+        self.tracing = False
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.step == self.first_step:
+            tf.profiler.experimental.start(path.join(PROFILE_FOLDER, "trace"))
+            self.tracing = True
+
+    def on_train_batch_end(self, batch, logs=None):
+        if self.tracing and self.step == self.last_step:
+            tf.profiler.experimental.stop()
+            self.tracing = False
+        self.step += 1
+
+    def on_train_end(self, logs=None):
+        # Il training è terminato (ad esempio per early stopping) prima di last_step.
+        if self.tracing:
+            tf.profiler.experimental.stop()
+            self.tracing = False
+
+
+def trace_callbacks() -> list:
+    """
+    Returns the callbacks capturing the TensorFlow profiler trace of the steps configured in PROFILE_STEPS.
+    """
+    if not cfg.PROFILE_STEPS:
+        return []
+    first_step, last_step = (int(step) for step in cfg.PROFILE_STEPS.split(","))
+    return [TraceSteps(first_step, last_step)]
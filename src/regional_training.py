@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import makedirs, path
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+import column_store
+import evaluation
+import partitioned_dataset
+import config as cfg
+from column_converters import STRING_COLUMNS_DTYPES
+
+"""
+Training di un modello per ogni valore di una colonna geografica (ad esempio Cod_reg, Areageo_3 o Pon).
+Il dataset con ambiti e processi viene letto una sola volta e salvato come archivio a colonne (vedi column_store.py);
+ogni modello viene addestrato da un processo invalsi.py separato, che apre l'archivio con memory mapping e legge
+solo i record della propria partizione (PARTITION_FILTER). Al più --workers processi sono in esecuzione
+contemporaneamente.
+Al termine viene scritto routing.json, usato da RoutedPredictor per inviare ogni record al modello della sua partizione.
+Va lanciato dalla cartella principale del repository, come invalsi.py.
+"""
+
+ROUTING_FILE_NAME = "routing.json"
+
+
+def regional_folder(column: str) -> str:
+    return path.join("src", "results", cfg.JOB_NAME, f"by_{column}")
+
+
+def partition_job_name(column: str, value: str) -> str:
+    return f"{cfg.JOB_NAME}_{partitioned_dataset.partition_folder(column, value)}"
+
+
+def load_dataset_ap() -> pd.DataFrame:
+    if cfg.PARTITIONED_DATASET:
+        dataset_ap = partitioned_dataset.load(cfg.PARTITIONED_DATASET)
+    else:
+        dataset_ap = pd.read_csv(cfg.CLEANED_DATASET_WITH_AP, dtype=STRING_COLUMNS_DTYPES)
+    if "Unnamed: 0" in dataset_ap.columns:
+        dataset_ap.drop("Unnamed: 0", axis=1, inplace=True)
+    return dataset_ap
+
+
+def prepare_column_store(column: str, store_folder: str, rebuild: bool) -> pd.Series:
+    """
+    Writes the column store of the dataset (unless it already exists) and returns the number of records of every
+    value of column, as strings (the same representation used by PARTITION_FILTER).
+    """
+    if rebuild or not path.exists(path.join(store_folder, column_store.MANIFEST_FILE_NAME)):
+        dataset_ap = load_dataset_ap()
+        print(f"Writing the column store of {len(dataset_ap):,} records to {store_folder}")
+        column_store.write(dataset_ap, store_folder)
+        del dataset_ap
+
+    manifest = column_store.read_manifest(store_folder)
+    values = pd.Series(column_store.column_values(store_folder, manifest["columns"][column]))
+    return values.dropna().astype(str).value_counts()
+
+
+def train_partition(column: str, value: str, store_folder: str, threads: int) -> dict:
+    job_name = partition_job_name(column, value)
+    env = os.environ.copy()
+    env.update({
+        "JOB_NAME": job_name,
+        "COLUMN_STORE": store_folder,
+        "PARTITION_FILTER": f"{column}={value}",
+        "PRE_ML": "False",
+        "CONVERT_DOMANDE_TO_AMBITI_PROCESSI": "False",
+        "INTRA_OP_THREADS": str(threads),
+        # Più processi condividono la stessa GPU: ognuno alloca solo la memoria che usa.
+        "TF_FORCE_GPU_ALLOW_GROWTH": "true",
+    })
+
+    start = time.perf_counter()
+    with open(path.join(regional_folder(column), f"{job_name}.log"), "w") as log_file:
+        exit_code = subprocess.call([sys.executable, path.join("src", "invalsi.py")], env=env,
+                                    stdout=log_file, stderr=subprocess.STDOUT)
+    results_folder = path.join("src", "results", job_name, cfg.PROBLEM_TYPE)
+
+    report = {}
+    report_path = path.join(results_folder, evaluation.REPORT_FILE_NAME)
+    if exit_code == 0 and path.exists(report_path):
+        with open(report_path) as report_file:
+            report = json.load(report_file)
+
+    return {
+        "value": value,
+        "job_name": job_name,
+        "exit_code": exit_code,
+        "wall_time": time.perf_counter() - start,
+        "model": path.join(results_folder, "model"),
+        "roc_auc": report.get("roc_auc"),
+    }
+
+
+def train_partitions(column: str, workers: int, min_records: int, rebuild: bool) -> list:
+    folder = regional_folder(column)
+    makedirs(folder, exist_ok=True)
+    store_folder = path.join(folder, "column_store")
+    counts = prepare_column_store(column, store_folder, rebuild)
+
+    skipped = counts[counts < min_records]
+    for value, records in skipped.items():
+        print(f"Skipping {column}={value}: {records:,} records (less than {min_records:,})")
+
+    # Le partizioni più grandi vengono avviate per prime, così che le ultime a terminare siano le più veloci.
+    values = list(counts[counts >= min_records].index)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"Training {len(values)} models by {column} with {workers} processes ({threads} threads each)")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda value: train_partition(column, value, store_folder, threads), values))
+
+    routing = {
+        "column": column,
+        "problem_type": cfg.PROBLEM_TYPE,
+        "models": {result["value"]: result["model"] for result in results
+                   if result["exit_code"] == 0 and path.exists(result["model"])},
+    }
+    with open(path.join(folder, ROUTING_FILE_NAME), "w") as routing_file:
+        json.dump(routing, routing_file, indent=2)
+
+    return results
+
+
+def print_results(column: str, results: list):
+    print(f"{column:>20}{'Exit':>6}{'Time (s)':>10}{'ROC AUC':>9}")
+    for result in results:
+        roc_auc = f"{result['roc_auc']:.4f}" if result["roc_auc"] is not None else "-"
+        print(f"{result['value']:>20}{result['exit_code']:>6}{result['wall_time']:>10.1f}{roc_auc:>9}")
+
+
+class RoutedPredictor:
+    """
+    Predicts every record with the model of its partition (see routing.json). Records are grouped by partition,
+    so every model predicts all of its records at once; records of partitions without a model get NaN predictions.
+    """
+
+    def __init__(self, routing_path: str):
+        with open(routing_path) as routing_file:
+            routing = json.load(routing_file)
+        self.column = routing["column"]
+        # Le predizioni vanno convertite in punteggi secondo il problema dei modelli, non secondo PROBLEM_TYPE.
+        self.problem_type = routing["problem_type"]
+        self.models = {value: tf.keras.models.load_model(model_path) for value, model_path in routing["models"].items()}
+
+    def predict(self, features: pd.DataFrame) -> np.ndarray:
+        keys = features[self.column].astype(str).to_numpy()
+        values, inverse = np.unique(keys, return_inverse=True)
+        # Indici dei record ordinati per partizione: il gruppo i-esimo è order[bounds[i-1]:bounds[i]].
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.cumsum(np.bincount(inverse, minlength=len(values)))[:-1]
+
+        predictions = None
+        for value, rows in zip(values, np.split(order, bounds)):
+            if value not in self.models:
+                continue
+            model = self.models[value]
+            group_predictions = evaluation.predict_full(model, features.iloc[rows][model.input_names])
+            if predictions is None:
+                predictions = np.full((len(features), group_predictions.shape[-1]), np.nan, dtype=np.float32)
+            predictions[rows] = group_predictions
+        if predictions is None:
+            raise ValueError(f"No model for the values of {self.column} of the given records.")
+        return predictions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trains one model for every value of a geographic column "
+                                                 "and predicts with the model of each record.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="trains the models (configured as invalsi.py)")
+    train_parser.add_argument("--column", default="Cod_reg", help="e.g. Cod_reg, Areageo_3, Areageo_5, Pon")
+    train_parser.add_argument("--workers", type=int, default=4, help="models trained at the same time")
+    train_parser.add_argument("--min-records", type=int, default=1000,
+                              help="partitions with fewer records are not trained")
+    train_parser.add_argument("--rebuild", action="store_true", help="writes the column store again")
+
+    predict_parser = subparsers.add_parser("predict", help="predicts the records of a CSV with the routed models")
+    predict_parser.add_argument("routing", help=f"{ROUTING_FILE_NAME} written by the train command")
+    predict_parser.add_argument("file_path", help="records with the same columns of the training dataset, "
+                                                  "with null values already filled")
+    predict_parser.add_argument("output_path")
+    arguments = parser.parse_args()
+
+    if arguments.command == "train":
+        if cfg.check_config() > 0:
+            sys.exit(1)
+        results = train_partitions(arguments.column, arguments.workers, arguments.min_records, arguments.rebuild)
+        print_results(arguments.column, results)
+    else:
+        predictor = RoutedPredictor(arguments.routing)
+        records = pd.read_csv(arguments.file_path, dtype={**STRING_COLUMNS_DTYPES, predictor.column: str})
+        scores = evaluation.dropout_scores(predictor.predict(records), predictor.problem_type)
+        pd.DataFrame({predictor.column: records[predictor.column], "score": scores}).to_csv(arguments.output_path,
+                                                                                           index=False)
@@ -0,0 +1,322 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import time
+from glob import glob
+from os import makedirs, path
+
+from sbatch_config import read_sbatch_config
+
+"""
+Registro delle esecuzioni di invalsi.py in un database SQLite: per ogni esecuzione vengono salvati la configurazione
+(config.config_dict()), le metriche di ogni epoca (history.history) e le metriche finali sul test set.
+Le tabelle sono indicizzate per chiave e valore di configurazione e per metrica, così che ordinare centinaia di
+esecuzioni per una metrica filtrandole per configurazione richieda pochi millisecondi.
+Il modulo non importa TensorFlow (né config.py, se non per il comando backfill), così che le interrogazioni da riga di
+comando siano immediate.
+Gli errori del registro (sqlite3.Error, ad esempio un database bloccato) non interrompono il training: invalsi.py
+prosegue senza registrare l'esecuzione.
+"""
+
+REGISTRY_PATH = path.join("src", "results", "runs.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_name TEXT NOT NULL,
+    problem_type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS runs_job ON runs (job_name, problem_type);
+
+CREATE TABLE IF NOT EXISTS config (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value TEXT,
+    number REAL,
+    PRIMARY KEY (run_id, key)
+);
+CREATE INDEX IF NOT EXISTS config_value ON config (key, value, run_id);
+CREATE INDEX IF NOT EXISTS config_number ON config (key, number, run_id);
+
+CREATE TABLE IF NOT EXISTS history (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    metric TEXT NOT NULL,
+    epoch INTEGER NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, metric, epoch)
+);
+
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    metric TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, metric)
+);
+CREATE INDEX IF NOT EXISTS metrics_value ON metrics (metric, value, run_id);
+"""
+
+FILTER_PATTERN = re.compile(r"^(\w+)(=|!=|<=|>=|<|>)(.*)$")
+
+
+def connect(registry_path: str = REGISTRY_PATH) -> sqlite3.Connection:
+    makedirs(path.dirname(registry_path) or ".", exist_ok=True)
+    # Più esecuzioni (ad esempio i training per regione) possono scrivere contemporaneamente.
+    connection = sqlite3.connect(registry_path, timeout=60)
+    # Journal di rollback e non WAL: il WAL non funziona su filesystem di rete, come quello del repository condiviso dai
+    # job slurm. La modalità è persistente nel file, quindi viene ripristinata anche nei registri creati in WAL.
+    connection.execute("PRAGMA journal_mode=DELETE")
+    connection.execute("PRAGMA foreign_keys=ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def as_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def start_run(config: dict, registry_path: str = REGISTRY_PATH) -> int:
+    """
+    Registers a new run with its configuration and returns its id.
+    """
+    with connect(registry_path) as connection:
+        cursor = connection.execute(
+            "INSERT INTO runs (job_name, problem_type, status, started_at) VALUES (?, ?, 'running', ?)",
+            (config["JOB_NAME"], config["PROBLEM_TYPE"], time.time()))
+        run_id = cursor.lastrowid
+        connection.executemany("INSERT INTO config (run_id, key, value, number) VALUES (?, ?, ?, ?)",
+                               [(run_id, key, str(value), as_number(value)) for key, value in config.items()])
+    connection.close()
+    return run_id
+
+
+def add_history(run_id: int, rows: list, registry_path: str = REGISTRY_PATH):
+    """
+    Writes in a single transaction the (epoch, metric, value) rows of a run.
+    """
+    with connect(registry_path) as connection:
+        connection.executemany("INSERT OR REPLACE INTO history (run_id, metric, epoch, value) VALUES (?, ?, ?, ?)",
+                               [(run_id, metric, epoch, value) for epoch, metric, value in rows])
+    connection.close()
+
+
+def history_metrics(history: dict) -> dict:
+    """
+    Metrics of the last epoch (last_<metric>) and number of epochs of a Keras history.
+    """
+    metrics = {f"last_{metric}": float(values[-1]) for metric, values in history.items() if values}
+    metrics["epochs"] = max((len(values) for values in history.values()), default=0)
+    return metrics
+
+
+def report_metrics(report: dict) -> dict:
+    """
+    Flattens the numeric values of an evaluation report (see evaluation.py), e.g. roc_auc or validation_f1.
+    """
+    # I report precedenti alla selezione della soglia sul validation set non hanno le chiavi validation*.
+    metrics = {key: float(report[key]) for key in ["records", "loss", "roc_auc", "pr_auc", "validation_loss",
+                                                   "validation_roc_auc", "validation_pr_auc", "validation_threshold",
+                                                   "optimal_threshold"] if key in report}
+    for name in ["default", "validation", "optimal"]:
+        if name in report:
+            metrics.update({f"{name}_{key}": float(value) for key, value in report[name].items()})
+    return metrics
+
+
+def finish_run(run_id: int, metrics: dict, registry_path: str = REGISTRY_PATH):
+    with connect(registry_path) as connection:
+        connection.executemany("INSERT OR REPLACE INTO metrics (run_id, metric, value) VALUES (?, ?, ?)",
+                               [(run_id, metric, value) for metric, value in metrics.items()])
+        connection.execute("UPDATE runs SET status = 'finished', finished_at = ? WHERE id = ?", (time.time(), run_id))
+    connection.close()
+
+
+def job_config(job_name: str, problem_type: str, registry_path: str = REGISTRY_PATH) -> dict:
+    """
+    Returns the configuration of the last finished run of job_name (empty if there is none in the registry).
+    """
+    if not path.exists(registry_path):
+        return {}
+    with connect(registry_path) as connection:
+        rows = connection.execute(
+            "SELECT key, value FROM config WHERE run_id = (SELECT MAX(id) FROM runs WHERE job_name = ? "
+            "AND problem_type = ? AND status = 'finished')", (job_name, problem_type)).fetchall()
+    connection.close()
+    return dict(rows)
+
+
+def parse_filter(expression: str) -> tuple:
+    match = FILTER_PATTERN.match(expression)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid filter {expression!r}, expected e.g. NEURONS=512 or LEARNING_RATE<0.01")
+    key, operator, value = match.groups()
+    if operator not in ["=", "!="] and as_number(value) is None:
+        raise argparse.ArgumentTypeError(f"invalid filter {expression!r}, {operator} needs a number")
+    return key, operator, value
+
+
+def lower_is_better(metric: str) -> bool:
+    return any(word in metric for word in ["loss", "mae", "fp", "fn"])
+
+
+def rank(connection: sqlite3.Connection, metric: str, filters: list, ascending: bool, limit: int) -> list:
+    """
+    Returns (run id, job name, problem type, metric value) of the finished runs matching every filter
+    (key, operator, value), ordered by metric. = and != compare the values as text, the other operators as numbers.
+    """
+    query = ["SELECT runs.id, runs.job_name, runs.problem_type, metrics.value FROM metrics "
+             "JOIN runs ON runs.id = metrics.run_id WHERE metrics.metric = ? AND runs.status = 'finished'"]
+    parameters = [metric]
+    for key, operator, value in filters:
+        column = "value" if operator in ["=", "!="] else "number"
+        query.append(f"AND EXISTS (SELECT 1 FROM config WHERE config.run_id = runs.id AND config.key = ? "
+                     f"AND config.{column} {operator} ?)")
+        parameters += [key, value if column == "value" else float(value)]
+    query.append(f"ORDER BY metrics.value {'ASC' if ascending else 'DESC'} LIMIT ?")
+    parameters.append(limit)
+    return connection.execute(" ".join(query), parameters).fetchall()
+
+
+def run_configs(connection: sqlite3.Connection, run_ids: list, keys: list) -> dict:
+    configs = {run_id: {} for run_id in run_ids}
+    if run_ids and keys:
+        query = (f"SELECT run_id, key, value FROM config WHERE run_id IN ({','.join('?' * len(run_ids))}) "
+                 f"AND key IN ({','.join('?' * len(keys))})")
+        for run_id, key, value in connection.execute(query, run_ids + keys):
+            configs[run_id][key] = value
+    return configs
+
+
+def print_ranking(rows: list, configs: dict, metric: str, keys: list):
+    header = "".join(f"{key:>{max(len(key), 10) + 2}}" for key in keys)
+    print(f"{'Run':>6}  {'Job':<40}{'Problem type':<18}{metric:>{max(len(metric), 10)}}{header}")
+    for run_id, job_name, problem_type, value in rows:
+        values = "".join(f"{configs[run_id].get(key, '-'):>{max(len(key), 10) + 2}}" for key in keys)
+        print(f"{run_id:>6}  {job_name:<40}{problem_type:<18}{value:>{max(len(metric), 10)}.4f}{values}")
+
+
+def sbatch_configs() -> dict:
+    """
+    Configurations exported by the slurm sbatch files, by (JOB_NAME, PROBLEM_TYPE).
+    """
+    configs = {}
+    for sbatch_path in glob(path.join("slurm", "*", "*.sbatch")):
+        config = read_sbatch_config(sbatch_path)
+        config.setdefault("PROBLEM_TYPE", "classification")
+        if "JOB_NAME" in config:
+            configs[(config["JOB_NAME"], config["PROBLEM_TYPE"])] = config
+    return configs
+
+
+def default_config() -> dict:
+    """
+    Default configuration of config.py (config_dict), without the keys set in the environment of this process.
+    """
+    import config as cfg
+
+    defaults = cfg.config_dict()
+    overridden = [key for key in defaults if key in os.environ]
+    if overridden:
+        print(f"Not used as defaults of the backfilled runs, as they are set in the environment: {', '.join(overridden)}")
+    return {key: value for key, value in defaults.items() if key not in overridden}
+
+
+def backfill(registry_path: str = REGISTRY_PATH) -> int:
+    """
+    Registers the runs executed before the registry existed, from their evaluation.json (src/results) and
+    history.json (src/img); their configuration is read from the slurm sbatch file with the same JOB_NAME, if any,
+    and completed with the defaults of config.py, as invalsi.py does. Runs already in the registry are skipped.
+    Returns the number of registered runs.
+    """
+    defaults = default_config()
+    configs = sbatch_configs()
+    connection = connect(registry_path)
+    registered = set(connection.execute("SELECT job_name, problem_type FROM runs").fetchall())
+    connection.close()
+
+    added = 0
+    for report_path in sorted(glob(path.join("src", "results", "*", "*", "evaluation.json"))):
+        with open(report_path) as report_file:
+            report = json.load(report_file)
+        job_name, problem_type = report["job_name"], report["problem_type"]
+        if (job_name, problem_type) in registered:
+            continue
+
+        config = {**defaults, **configs.get((job_name, problem_type), {}),
+                  "JOB_NAME": job_name, "PROBLEM_TYPE": problem_type}
+        run_id = start_run(config, registry_path)
+        metrics = report_metrics(report)
+        history_path = path.join("src", "img", job_name, problem_type, "history.json")
+        if path.exists(history_path):
+            with open(history_path) as history_file:
+                history = json.load(history_file)
+            add_history(run_id, [(epoch, metric, value) for metric, values in history.items()
+                                 for epoch, value in enumerate(values)], registry_path)
+            metrics.update(history_metrics(history))
+        finish_run(run_id, metrics, registry_path)
+        added += 1
+    return added
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queries the registry of the runs of invalsi.py.")
+    parser.add_argument("--registry", default=REGISTRY_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rank_parser = subparsers.add_parser("rank", help="ranks the finished runs by a metric")
+    rank_parser.add_argument("metric", help="e.g. roc_auc, pr_auc, loss, validation_f1, last_val_loss, epochs")
+    rank_parser.add_argument("--where", type=parse_filter, action="append", default=[],
+                             help="configuration filter, e.g. PROBLEM_TYPE=classification or NEURONS>=256 "
+                                  "(can be repeated)")
+    rank_parser.add_argument("--show", type=lambda keys: keys.split(","), default=[],
+                             help="comma separated configuration keys shown for every run")
+    # Equivalente a argparse.BooleanOptionalAction, non disponibile in Python 3.7.
+    order_group = rank_parser.add_mutually_exclusive_group()
+    order_group.add_argument("--ascending", dest="ascending", action="store_const", const=True, default=None,
+                             help="lowest values first (default for losses, mae and error counts)")
+    order_group.add_argument("--no-ascending", dest="ascending", action="store_const", const=False,
+                             help="highest values first (default for the other metrics)")
+    rank_parser.add_argument("--limit", type=int, default=20)
+
+    show_parser = subparsers.add_parser("show", help="prints configuration, final metrics and history of a run")
+    show_parser.add_argument("run_id", type=int)
+
+    subparsers.add_parser("backfill", help="registers the runs with an evaluation.json not yet in the registry")
+    arguments = parser.parse_args()
+
+    if arguments.command == "rank":
+        ascending = arguments.ascending if arguments.ascending is not None else lower_is_better(arguments.metric)
+        connection = connect(arguments.registry)
+        start = time.perf_counter()
+        rows = rank(connection, arguments.metric, arguments.where, ascending, arguments.limit)
+        configs = run_configs(connection, [row[0] for row in rows], arguments.show)
+        elapsed = time.perf_counter() - start
+        print_ranking(rows, configs, arguments.metric, arguments.show)
+        print(f"{len(rows)} runs ({1000 * elapsed:.1f} ms)")
+    elif arguments.command == "show":
+        connection = connect(arguments.registry)
+        for key, value in connection.execute("SELECT key, value FROM config WHERE run_id = ? ORDER BY rowid", (arguments.run_id,)):
+            print(f"{key}: ", value)
+        print()
+        for metric, value in connection.execute("SELECT metric, value FROM metrics WHERE run_id = ? ORDER BY metric",
+                                                (arguments.run_id,)):
+            print(f"{metric}: {value:.4f}")
+        history = {}
+        for metric, epoch, value in connection.execute(
+                "SELECT metric, epoch, value FROM history WHERE run_id = ? ORDER BY metric, epoch", (arguments.run_id,)):
+            history.setdefault(metric, []).append(value)
+        if history:
+            print()
+            print("Epoch " + "".join(f"{metric:>12}" for metric in history))
+            for epoch in range(max(len(values) for values in history.values())):
+                print(f"{epoch + 1:>5} " + "".join(f"{values[epoch]:>12.4f}" if epoch < len(values) else f"{'-':>12}"
+                                                   for values in history.values()))
+    else:
+        print(f"Registered {backfill(arguments.registry)} runs")
@@ -1,127 +1,175 @@
-from os import makedirs, path
-
-import matplotlib.pyplot as plt
-
-import config as cfg
-
-IMAGE_FOLDER = path.join("src", "img", cfg.JOB_NAME, cfg.PROBLEM_TYPE)
-
-makedirs(IMAGE_FOLDER, exist_ok=True)
-
-
-def plot_main_metric(history: dict):
-    f = plt.figure()
-    if cfg.PROBLEM_TYPE == "classification":
-        main_metric_name = 'acc'
-    elif cfg.PROBLEM_TYPE == "regression":
-        main_metric_name = 'bin_acc'
-    else: # cfg.PROBLEM_TYPE == "pure_regression"
-        main_metric_name = 'mae'
-    plt.plot(history[main_metric_name])
-    plt.plot(history[f'val_{main_metric_name}'])
-    plt.title("Accuracy" if cfg.PROBLEM_TYPE != "pure_regression" else "MAE" + " during training")
-    plt.ylabel("Accuracy" if cfg.PROBLEM_TYPE != "pure_regression" else "MAE")
-    plt.xlabel('Epochs')
-    plt.legend(['Train', 'Validation'], loc='upper left')
-
-    plt.savefig(path.join(IMAGE_FOLDER, "accuracy.png" if cfg.PROBLEM_TYPE != "pure_regression" else "mae.png"))
-
-    plt.clf()
-
-
-def plot_loss(history: dict):
-    f = plt.figure()
-    plt.plot(history['loss'])
-    plt.plot(history['val_loss'])
-    plt.title("Loss during training")
-    plt.ylabel('Loss')
-    plt.xlabel('Epochs')
-    plt.legend(['Train', 'Validation'], loc='upper left')
-
-    plt.savefig(path.join(IMAGE_FOLDER, 'loss.png'))
-
-    plt.clf()
-
-
-def plot_tp(history: dict):
-    f = plt.figure()
-    plt.plot(history['tp'])
-    plt.plot(history['val_tp'])
-    plt.title("True positives during training")
-    plt.ylabel('True positives')
-    plt.xlabel('Epochs')
-    plt.legend(['Train', 'Validation'], loc='upper left')
-
-    plt.savefig(path.join(IMAGE_FOLDER, 'tp.png'))
-
-    plt.clf()
+import argparse
+import json
+import subprocess
+import sys
+from glob import glob
+from multiprocessing import get_context
+from os import cpu_count, makedirs, path
 
+import matplotlib
 
-def plot_fp(history: dict):
-    f = plt.figure()
-    plt.plot(history['fp'])
-    plt.plot(history['val_fp'])
-    plt.title("False positives during training")
-    plt.ylabel('False positives')
-    plt.xlabel('Epochs')
-    plt.legend(['Train', 'Validation'], loc='upper left')
+# Backend non interattivo: le immagini vengono solo salvate su file.
+matplotlib.use("Agg")
 
-    plt.savefig(path.join(IMAGE_FOLDER, 'fp.png'))
-
-    plt.clf()
-
-
-def plot_tn(history: dict):
-    f = plt.figure()
-    plt.plot(history['tn'])
-    plt.plot(history['val_tn'])
-    plt.title("True negatives during training")
-    plt.ylabel('True negatives')
-    plt.xlabel('Epochs')
-    plt.legend(['Train', 'Validation'], loc='upper left')
-
-    plt.savefig(path.join(IMAGE_FOLDER, 'tn.png'))
-
-    plt.clf()
-
-
-def plot_fn(history: dict):
-    f = plt.figure()
-    plt.plot(history['fn'])
-    plt.plot(history['val_fn'])
-    plt.title("False negatives during training")
-    plt.ylabel('False negatives')
-    plt.xlabel('Epochs')
-    plt.legend(['Train', 'Validation'], loc='upper left')
-
-    plt.savefig(path.join(IMAGE_FOLDER, 'fn.png'))
-
-    plt.clf()
-
-
-def plot_precision(history: dict):
-    f = plt.figure()
-    plt.plot(history['prec'])
-    plt.plot(history['val_prec'])
-    plt.title("Precision during training")
-    plt.ylabel('Precision')
-    plt.xlabel('Epochs')
-    plt.legend(['Train', 'Validation'], loc='upper left')
-
-    plt.savefig(path.join(IMAGE_FOLDER, 'precision.png'))
-
-    plt.clf()
-
-
-def plot_recall(history: dict):
-    f = plt.figure()
-    plt.plot(history['rec'])
-    plt.plot(history['val_rec'])
-    plt.title("Recall during training")
-    plt.ylabel('Recall')
-    plt.xlabel('Epochs')
-    plt.legend(['Train', 'Validation'], loc='upper left')
+import matplotlib.pyplot as plt
 
-    plt.savefig(path.join(IMAGE_FOLDER, 'recall.png'))
+import config as cfg
 
-    plt.clf()
\ No newline at end of file
+IMAGES_ROOT = path.join("src", "img")
+IMAGE_FOLDER = path.join(IMAGES_ROOT, cfg.JOB_NAME, cfg.PROBLEM_TYPE)
+HISTORY_FILE_NAME = "history.json"
+PANEL_FILE_NAME = "metrics.png"
+
+# I processi di rendering vengono creati con spawn: fare fork di un processo con i thread di TensorFlow già avviati
+# può bloccare il processo figlio.
+process_context = get_context("spawn")
+
+
+def metric_specs(problem_type: str) -> list:
+    """
+    Returns the plotted metrics as (key in history, label, image file name).
+    """
+    if problem_type == "classification":
+        main_metric = ("acc", "Accuracy", "accuracy.png")
+    elif problem_type == "regression":
+        main_metric = ("bin_acc", "Accuracy", "accuracy.png")
+    else: # problem_type == "pure_regression"
+        main_metric = ("mae", "MAE", "mae.png")
+
+    return [
+        main_metric,
+        ("loss", "Loss", "loss.png"),
+        ("tp", "True positives", "tp.png"),
+        ("tn", "True negatives", "tn.png"),
+        ("fp", "False positives", "fp.png"),
+        ("fn", "False negatives", "fn.png"),
+        ("rec", "Recall", "recall.png"),
+        ("prec", "Precision", "precision.png"),
+    ]
+
+
+def plot_metric(axes, history: dict, key: str, label: str):
+    axes.plot(history[key])
+    axes.plot(history[f'val_{key}'])
+    axes.set_title(f"{label} during training")
+    axes.set_ylabel(label)
+    axes.set_xlabel('Epochs')
+    axes.legend(['Train', 'Validation'], loc='upper left')
+
+
+def render(history: dict, image_folder: str, problem_type: str, layout: str):
+    """
+    Renders the metrics in history to image_folder, one file per metric (layout "separate"),
+    all in a single multi-panel figure (layout "panel") or both (layout "both").
+    """
+    makedirs(image_folder, exist_ok=True)
+    specs = [spec for spec in metric_specs(problem_type) if spec[0] in history]
+
+    if layout in ["separate", "both"]:
+        for key, label, file_name in specs:
+            figure, axes = plt.subplots()
+            plot_metric(axes, history, key, label)
+            figure.savefig(path.join(image_folder, file_name))
+            plt.close(figure)
+
+    if layout in ["panel", "both"]:
+        columns = 4
+        rows = (len(specs) + columns - 1) // columns
+        figure, all_axes = plt.subplots(rows, columns, figsize=(5 * columns, 4 * rows), squeeze=False)
+        for axes, (key, label, _) in zip(all_axes.flat, specs):
+            plot_metric(axes, history, key, label)
+        for axes in all_axes.flat[len(specs):]:
+            axes.set_visible(False)
+        figure.tight_layout()
+        figure.savefig(path.join(image_folder, PANEL_FILE_NAME))
+        plt.close(figure)
+
+
+def save_history(history: dict, image_folder: str):
+    makedirs(image_folder, exist_ok=True)
+    with open(path.join(image_folder, HISTORY_FILE_NAME), "w") as history_file:
+        json.dump({key: [float(value) for value in values] for key, values in history.items()}, history_file)
+
+
+def render_in_background(history: dict) -> subprocess.Popen:
+    """
+    Saves history next to the images (so that they can be regenerated later) and renders the plots
+    in a separate process running this script on the saved history. The returned process should be waited before exiting.
+    """
+    save_history(history, IMAGE_FOLDER)
+    return subprocess.Popen([sys.executable, path.abspath(__file__), "--run", IMAGE_FOLDER,
+                             "--problem-type", cfg.PROBLEM_TYPE, "--layout", cfg.PLOT_LAYOUT])
+
+
+def load_history(image_folder: str) -> dict:
+    with open(path.join(image_folder, HISTORY_FILE_NAME)) as history_file:
+        return json.load(history_file)
+
+
+def render_run(image_folder: str, problem_type: str, layout: str):
+    render(load_history(image_folder), image_folder, problem_type, layout)
+
+
+def render_comparison(histories: dict, problem_type: str):
+    """
+    Renders one panel per metric with the validation curve of every run (histories is job name -> history).
+    """
+    specs = metric_specs(problem_type)
+    columns = 4
+    rows = (len(specs) + columns - 1) // columns
+    figure, all_axes = plt.subplots(rows, columns, figsize=(6 * columns, 5 * rows), squeeze=False)
+    for axes, (key, label, _) in zip(all_axes.flat, specs):
+        for job_name, history in sorted(histories.items()):
+            if f'val_{key}' in history:
+                axes.plot(history[f'val_{key}'], label=job_name)
+        axes.set_title(f"Validation {label.lower()}")
+        axes.set_ylabel(label)
+        axes.set_xlabel('Epochs')
+    for axes in all_axes.flat[len(specs):]:
+        axes.set_visible(False)
+
+    handles, labels = all_axes.flat[0].get_legend_handles_labels()
+    figure.legend(handles, labels, loc='center right', fontsize='small')
+    figure.tight_layout(rect=(0, 0, 0.85, 1))
+    figure.savefig(path.join(IMAGES_ROOT, f"comparison_{problem_type}.png"))
+    plt.close(figure)
+
+
+def compare_runs(problem_type: str, layout: str, workers: int):
+    """
+    Regenerates in parallel the plots of every run in src/img/<JOB_NAME>/<problem_type>/ with a saved history,
+    then renders the comparison report src/img/comparison_<problem_type>.png.
+    Runs without a saved history (trained before histories were saved) are skipped.
+    """
+    run_folders = sorted(glob(path.join(IMAGES_ROOT, "*", problem_type)))
+    image_folders = [folder for folder in run_folders if path.exists(path.join(folder, HISTORY_FILE_NAME))]
+    skipped = [path.basename(path.dirname(folder)) for folder in run_folders if folder not in image_folders]
+    if skipped:
+        print(f"Skipped {len(skipped)} runs without a saved {HISTORY_FILE_NAME}: {', '.join(skipped)}")
+    if not image_folders:
+        print(f"No run with a saved {HISTORY_FILE_NAME} for {problem_type}.")
+        return
+
+    with process_context.Pool(workers) as pool:
+        pool.starmap(render_run, [(image_folder, problem_type, layout) for image_folder in image_folders])
+
+    histories = {path.basename(path.dirname(image_folder)): load_history(image_folder) for image_folder in image_folders}
+    render_comparison(histories, problem_type)
+    print(f"Rendered {len(image_folders)} runs for {problem_type}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Regenerates the plots of all the saved runs and their comparison. "
+                                                 f"Only runs with a saved {HISTORY_FILE_NAME} (written by invalsi.py "
+                                                 "next to the images) can be rendered: older runs are skipped.")
+    parser.add_argument("--problem-type", choices=["classification", "regression", "pure_regression"],
+                        default=cfg.PROBLEM_TYPE)
+    parser.add_argument("--layout", choices=["separate", "panel", "both"], default=cfg.PLOT_LAYOUT)
+    parser.add_argument("--workers", type=int, default=cpu_count())
+    parser.add_argument("--run", help="renders only the run with the given image folder (used by invalsi.py)")
+    arguments = parser.parse_args()
+
+    if arguments.run:
+        render_run(arguments.run, arguments.problem_type, arguments.layout)
+    else:
+        compare_runs(arguments.problem_type, arguments.layout, arguments.workers)
@@ -0,0 +1,19 @@
+import re
+
+"""
+Lettura della configurazione dei file .sbatch di slurm/ (righe export), condivisa da learning_curve.py
+e run_registry.py.
+"""
+
+
+def read_sbatch_config(file_path: str) -> dict:
+    """
+    Returns the environment variables exported by an sbatch file.
+    """
+    config = {}
+    with open(file_path) as sbatch_file:
+        for line in sbatch_file:
+            match = re.match(r"^\s*export\s+(\w+)=(.*)$", line)
+            if match:
+                config[match.group(1)] = match.group(2).strip().strip("\"'")
+    return config
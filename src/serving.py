@@ -0,0 +1,172 @@
+import argparse
+import json
+import time
+from os import path
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+import evaluation
+import config as cfg
+
+"""
+Funzione di inferenza per il modello salvato da invalsi.py (RESULTS_FOLDER/model).
+Per ogni dimensione di batch di un insieme fissato (bucket) viene tracciata una funzione concreta con firma fissa,
+che riceve le colonne in input come argomenti posizionali (nell'ordine di model.input_names); le funzioni vengono
+eseguite una volta al caricamento, così che la prima richiesta non paghi il costo del tracing.
+Le richieste ricevono colonne NumPy già impacchettate (vedi pack) e vengono completate fino al bucket più piccolo
+che le contiene, evitando la costruzione di dizionari e l'overhead di model.predict per ogni chiamata.
+Va lanciato dalla cartella principale del repository, come invalsi.py.
+"""
+
+DEFAULT_BUCKETS = [1, 16, 256, 4096]
+BENCHMARK_BATCH_SIZES = [1, 16, 256, 4096]
+BENCHMARK_FILE_NAME = "serving_benchmark.json"
+
+
+def numpy_dtype(dtype: tf.DType):
+    # Le stringhe vengono passate come array di oggetti Python (str o bytes).
+    return object if dtype == tf.string else dtype.as_numpy_dtype
+
+
+class ServingModel:
+    """
+    Serves a model with one concrete function for every bucket batch size.
+    Requests larger than the largest bucket are split in chunks of that size.
+    Not thread safe: the padding buffers of each bucket are reused between calls.
+    """
+
+    def __init__(self, model: tf.keras.Model, buckets: list = None):
+        self.model = model
+        self.buckets = sorted(buckets or DEFAULT_BUCKETS)
+        self.input_names = list(model.input_names)
+        self.dtypes = [tensor.dtype for tensor in model.inputs]
+
+        @tf.function
+        def serve(*columns):
+            return model(dict(zip(self.input_names, columns)), training=False)
+
+        self.functions = {}
+        self.buffers = {}
+        for bucket in self.buckets:
+            # Le firme sono posizionali: i nomi delle colonne (anche non ASCII, es. regolarità) non servono.
+            specs = [tf.TensorSpec(shape=[bucket], dtype=dtype) for dtype in self.dtypes]
+            self.functions[bucket] = serve.get_concrete_function(*specs)
+            self.buffers[bucket] = [np.full(bucket, "" if dtype == tf.string else 0, dtype=numpy_dtype(dtype))
+                                    for dtype in self.dtypes]
+
+        # Riscaldamento: la prima esecuzione di ogni funzione alloca le risorse del runtime.
+        for bucket in self.buckets:
+            self.functions[bucket](*self.buffers[bucket])
+
+    @classmethod
+    def load(cls, model_path: str, buckets: list = None):
+        return cls(tf.keras.models.load_model(model_path), buckets)
+
+    def pack(self, records) -> list:
+        """
+        Packs records (a DataFrame or a dict of columns) in the positional columns accepted by predict,
+        with the dtypes of the model inputs. Packing should be done once, not for every request.
+        """
+        return [np.ascontiguousarray(records[name], dtype=numpy_dtype(dtype))
+                for name, dtype in zip(self.input_names, self.dtypes)]
+
+    def predict(self, columns: list) -> np.ndarray:
+        """
+        Predicts the records of the packed columns (see pack).
+        """
+        records = len(columns[0])
+        largest = self.buckets[-1]
+        if records > largest:
+            return np.concatenate([self.predict([column[start:start + largest] for column in columns])
+                                   for start in range(0, records, largest)])
+
+        bucket = next(bucket for bucket in self.buckets if bucket >= records)
+        if bucket == records:
+            return self.functions[bucket](*columns).numpy()
+
+        # Le colonne vengono copiate nei buffer del bucket: i record in più contengono valori di richieste precedenti
+        # e le loro predizioni vengono scartate.
+        buffers = self.buffers[bucket]
+        for buffer, column in zip(buffers, columns):
+            buffer[:records] = column
+        return self.functions[bucket](*buffers).numpy()[:records]
+
+
+def benchmark_inputs(model: tf.keras.Model, records: int) -> pd.DataFrame:
+    """
+    Records used by the benchmark: the test set saved by invalsi.py (SAVE_TEST_SET=True) if present,
+    otherwise records with default values (unknown categories are mapped to the out of vocabulary index).
+    """
+    if path.exists(path.join(cfg.RESULTS_FOLDER, evaluation.TEST_SET_FILE_NAME)):
+        test_set = evaluation.load_test_set()
+        return test_set.sample(records, replace=len(test_set) < records, random_state=19).reset_index(drop=True)
+    return pd.DataFrame({name: np.full(records, "" if tensor.dtype == tf.string else 0, dtype=object)
+                         for name, tensor in zip(model.input_names, model.inputs)})
+
+
+def latency(function, repeats: int) -> np.ndarray:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return np.array(times) * 1000
+
+
+def run_benchmark(serving_model: ServingModel, batch_sizes: list, repeats: int) -> list:
+    model = serving_model.model
+    records = benchmark_inputs(model, max(batch_sizes))
+    results = []
+    for batch_size in batch_sizes:
+        batch = records.iloc[:batch_size]
+        columns = serving_model.pack(batch)
+        features = {name: column for name, column in zip(serving_model.input_names, columns)}
+
+        # Le predizioni devono coincidere con quelle di Keras.
+        np.testing.assert_allclose(serving_model.predict(columns), model.predict(features, batch_size=batch_size),
+                                   rtol=1e-4, atol=1e-5)
+
+        for name, function in [("keras_predict", lambda: model.predict(features, batch_size=batch_size)),
+                               ("serving", lambda: serving_model.predict(columns))]:
+            # La prima chiamata viene esclusa: model.predict crea la sua funzione alla prima esecuzione.
+            function()
+            times = latency(function, repeats if batch_size < 4096 else max(1, repeats // 10))
+            results.append({
+                "method": name,
+                "batch_size": batch_size,
+                "median_ms": float(np.median(times)),
+                "p95_ms": float(np.percentile(times, 95)),
+                "records_per_sec": float(batch_size / (np.median(times) / 1000)),
+            })
+    return results
+
+
+def print_benchmark(results: list):
+    print(f"{'Method':<16}{'Batch size':>12}{'Median (ms)':>14}{'p95 (ms)':>12}{'Records/s':>14}")
+    for result in results:
+        print(f"{result['method']:<16}{result['batch_size']:>12}{result['median_ms']:>14.3f}"
+              f"{result['p95_ms']:>12.3f}{result['records_per_sec']:>14,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the latency of the serving functions of the model "
+                                                 "saved by invalsi.py (configured by JOB_NAME and PROBLEM_TYPE) "
+                                                 "against model.predict.")
+    parser.add_argument("--model", default=path.join(cfg.RESULTS_FOLDER, "model"))
+    parser.add_argument("--buckets", type=lambda buckets: [int(b) for b in buckets.split(",")], default=DEFAULT_BUCKETS,
+                        help="comma separated list of the batch sizes with a concrete function")
+    parser.add_argument("--repeats", type=int, default=200, help="calls measured for every batch size")
+    arguments = parser.parse_args()
+
+    start = time.perf_counter()
+    serving_model = ServingModel.load(arguments.model, arguments.buckets)
+    print(f"Loaded and warmed up {len(serving_model.buckets)} serving functions in {time.perf_counter() - start:.1f}s")
+
+    results = run_benchmark(serving_model, BENCHMARK_BATCH_SIZES, arguments.repeats)
+    with open(path.join(cfg.RESULTS_FOLDER, BENCHMARK_FILE_NAME), "w") as benchmark_file:
+        json.dump(results, benchmark_file, indent=2)
+
+    print()
+    print_benchmark(results)
@@ -0,0 +1,227 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import preprocessing
+from column_converters import COLUMN_CONVERTERS
+from mapping_domande_ambiti_processi import MAPPING_DOMANDE_AMBITI_PROCESSI
+
+"""
+Generatore di dataset sintetici con lo stesso schema del dataset INVALSI originale (vedi column_converters.py).
+I valori sono plausibili ma casuali: servono a misurare tempi e memoria della pipeline, non a studiare il dropout.
+"""
+
+CHUNK_ROWS = 250_000
+
+# (Cod_reg, Nome_reg, Areageo_3, Areageo_4, Areageo_5, Areageo_5_Istat, Pon, cod_provincia_ISTAT, sigla_provincia_istat)
+REGIONS = [
+    ("1", "Piemonte", "Nord", "Nord Ovest", "Nord ovest", "Nord-ovest", False, "1", "TO"),
+    ("2", "Valle d'Aosta", "Nord", "Nord Ovest", "Nord ovest", "Nord-ovest", False, "7", "AO"),
+    ("3", "Lombardia", "Nord", "Nord Ovest", "Nord ovest", "Nord-ovest", False, "15", "MI"),
+    ("4", "Trentino-Alto Adige", "Nord", "Nord Est", "Nord est", "Nord-est", False, "22", "TN"),
+    ("5", "Veneto", "Nord", "Nord Est", "Nord est", "Nord-est", False, "27", "VE"),
+    ("6", "Friuli-Venezia Giulia", "Nord", "Nord Est", "Nord est", "Nord-est", False, "32", "TS"),
+    ("7", "Liguria", "Nord", "Nord Ovest", "Nord ovest", "Nord-ovest", False, "10", "GE"),
+    ("8", "Emilia-Romagna", "Nord", "Nord Est", "Nord est", "Nord-est", False, "37", "BO"),
+    ("9", "Toscana", "Centro", "Centro", "Centro", "Centro", False, "48", "FI"),
+    ("10", "Umbria", "Centro", "Centro", "Centro", "Centro", False, "54", "PG"),
+    ("11", "Marche", "Centro", "Centro", "Centro", "Centro", False, "42", "AN"),
+    ("12", "Lazio", "Centro", "Centro", "Centro", "Centro", False, "58", "RM"),
+    ("13", "Abruzzo", "Mezzogiorno", "Mezzogiorno", "Sud", "Sud", False, "66", "AQ"),
+    ("14", "Molise", "Mezzogiorno", "Mezzogiorno", "Sud", "Sud", False, "70", "CB"),
+    ("15", "Campania", "Mezzogiorno", "Mezzogiorno", "Sud", "Sud", True, "63", "NA"),
+    ("16", "Puglia", "Mezzogiorno", "Mezzogiorno", "Sud", "Sud", True, "72", "BA"),
+    ("17", "Basilicata", "Mezzogiorno", "Mezzogiorno", "Sud", "Sud", True, "76", "PZ"),
+    ("18", "Calabria", "Mezzogiorno", "Mezzogiorno", "Sud", "Sud", True, "79", "CZ"),
+    ("19", "Sicilia", "Mezzogiorno", "Mezzogiorno", "Sud e isole", "Isole", True, "82", "PA"),
+    ("20", "Sardegna", "Mezzogiorno", "Mezzogiorno", "Sud e isole", "Isole", True, "92", "CA"),
+]
+
+# Vocabolari delle colonne categoriche stringa, con le relative probabilità (None = uniforme).
+VOCABULARIES = {
+    "sesso": (["Maschio", "Femmina"], None),
+    "mese": (["Gennaio", "Febbraio", "Marzo", "Aprile", "Maggio", "Giugno", "Luglio", "Agosto", "Settembre",
+              "Ottobre", "Novembre", "Dicembre"], None),
+    "anno": (["2000", "2001", "2002", "2003"], [0.05, 0.15, 0.75, 0.05]),
+    "luogo": (["Italia", "Paese UE", "Paese europeo non UE", "Altro paese", "Mancante"],
+              [0.88, 0.03, 0.03, 0.03, 0.03]),
+    "eta": (["Regolare", "Anticipatario", "Posticipatario"], [0.85, 0.03, 0.12]),
+    "freq_asilo_nido": (["Sì", "No", "Non ricordo", "Mancante"], [0.4, 0.35, 0.15, 0.1]),
+    "freq_scuola_materna": (["Sì, più di un anno", "Sì, un anno o meno", "No", "Non ricordo", "Mancante"],
+                            [0.75, 0.08, 0.04, 0.08, 0.05]),
+    "titolo_padre": (["Licenza elementare", "Licenza media", "Qualifica professionale", "Diploma di maturità",
+                      "Laurea o titolo superiore", "Mancante"], [0.03, 0.3, 0.1, 0.3, 0.12, 0.15]),
+    "prof_padre": (["Disoccupato", "Casalingo", "Dirigente", "Lavoratore in proprio", "Insegnante, impiegato",
+                    "Operaio", "Pensionato", "Mancante"], [0.05, 0.01, 0.1, 0.2, 0.2, 0.25, 0.04, 0.15]),
+    "cittadinanza": (["Italiano", "Straniero I generazione", "Straniero II generazione"], [0.9, 0.05, 0.05]),
+    "regolarità": (["Regolare", "Anticipatario", "Posticipatario"], [0.85, 0.03, 0.12]),
+}
+VOCABULARIES["luogo_padre"] = VOCABULARIES["luogo"]
+VOCABULARIES["luogo_madre"] = VOCABULARIES["luogo"]
+VOCABULARIES["titolo_madre"] = VOCABULARIES["titolo_padre"]
+VOCABULARIES["prof_madre"] = VOCABULARIES["prof_padre"]
+
+QUESTIONS = list(MAPPING_DOMANDE_AMBITI_PROCESSI.keys())
+
+# Frazione di voti mancanti nel dataset originale (vedi preprocessing.COLUMNS_LOW_RATIO_NULL_VALUES).
+NAN_RATIO_VOTI = {
+    "voto_scritto_ita": 0.683,
+    "voto_orale_ita": 0.683,
+    "voto_scritto_mat": 0.113,
+    "voto_orale_mat": 0.114,
+}
+
+def choice(rng: np.random.Generator, values: list, rows: int, p: list = None) -> np.ndarray:
+    return np.asarray(values, dtype=object)[rng.choice(len(values), size=rows, p=p)]
+
+
+def voti(rng: np.random.Generator, ability: np.ndarray, nan_ratio: float, nan_markers: list) -> np.ndarray:
+    """
+    Generates grades as in the original CSV: '1'..'10', 'Non classificato' or one of nan_markers.
+    """
+    rows = ability.size
+    grades = np.clip(np.rint(6.5 + 1.3 * ability + rng.normal(0, 0.8, rows)), 1, 10).astype(np.int64)
+    result = np.asarray([str(grade) for grade in range(11)], dtype=object)[grades]
+    missing = rng.random(rows)
+    result[missing < nan_ratio] = choice(rng, nan_markers, int((missing < nan_ratio).sum()))
+    result[(missing >= nan_ratio) & (missing < nan_ratio + 0.002)] = "Non classificato"
+    return result
+
+
+def generate_original(rows: int, seed: int = 19, first_index: int = 0) -> pd.DataFrame:
+    """
+    Generates rows records of the original dataset, with the raw string values the converters in
+    COLUMN_CONVERTERS expect (i.e. as they are read from the CSV).
+    """
+    rng = np.random.default_rng(seed)
+    ability = rng.normal(0, 1, rows)
+    region = rng.choice(len(REGIONS), size=rows)
+    regions = np.asarray(REGIONS, dtype=object)
+
+    schools = max(1, rows // 200)
+    school = rng.integers(1, schools + 1, rows)
+    plesso = school * 10 + rng.integers(0, 3, rows)
+    classe = plesso * 10 + rng.integers(0, 5, rows)
+
+    data = {
+        "CODICE_SCUOLA": school.astype(np.float64),
+        "CODICE_PLESSO": plesso.astype(np.float64),
+        "CODICE_CLASSE": classe.astype(np.float64),
+        "macrotipologia": np.full(rows, "Licei", dtype=object),
+        "campione": rng.integers(0, 2, rows),
+        "livello": np.full(rows, 10),
+        "prog": rng.integers(1, 31, rows),
+        "CODICE_STUDENTE": np.arange(first_index, first_index + rows).astype(str),
+        "codice_orario": np.full(rows, "Mancante di sistema", dtype=object),
+        "voto_scritto_ita": voti(rng, ability, NAN_RATIO_VOTI["voto_scritto_ita"],
+                                 ["Non disponibile", "Senza voto scritto"]),
+        "voto_orale_ita": voti(rng, ability, NAN_RATIO_VOTI["voto_orale_ita"], ["Non disponibile"]),
+        "voto_scritto_mat": voti(rng, ability, NAN_RATIO_VOTI["voto_scritto_mat"],
+                                 ["Non disponibile", "Senza voto scritto"]),
+        "voto_orale_mat": voti(rng, ability, NAN_RATIO_VOTI["voto_orale_mat"], ["Non disponibile"]),
+    }
+    for name, (values, p) in VOCABULARIES.items():
+        data[name] = choice(rng, values, rows, p)
+
+    difficulty = rng.normal(0, 1, len(QUESTIONS))
+    correct = rng.random((rows, len(QUESTIONS))) < 1 / (1 + np.exp(difficulty - ability[:, np.newaxis]))
+    unanswered = rng.random((rows, len(QUESTIONS))) < 0.03
+    correct &= ~unanswered
+    answers = np.where(correct, "Corretta", "Errata").astype(object)
+    answers[unanswered] = "Non risposta"
+    for i, question in enumerate(QUESTIONS):
+        data[question] = answers[:, i]
+
+    sigla = regions[region, 8].copy()
+    sigla[rng.random(rows) < 0.001] = ""
+    data.update({
+        "cod_provincia_ISTAT": regions[region, 7],
+        "sigla_provincia_istat": sigla,
+        "Nome_reg": regions[region, 1],
+        "Cod_reg": regions[region, 0],
+        "Areageo_3": regions[region, 2],
+        "Areageo_4": regions[region, 3],
+        "Areageo_5": regions[region, 4],
+        "Areageo_5_Istat": regions[region, 5],
+        "Pon": np.where(regions[region, 6].astype(bool), "Area_Pon", "Area_non_Pon").astype(object),
+    })
+
+    wle = ability + rng.normal(0, 0.3, rows)
+    correction = rng.uniform(0.9, 1.0, rows)
+    pu_ma_gr = correct.sum(axis=1).astype(np.float64)
+    data.update({
+        "pu_ma_gr": pu_ma_gr,
+        "pu_ma_no": 100 * pu_ma_gr / len(QUESTIONS),
+        "Fattore_correzione_new": correction,
+        "Cheating": rng.uniform(0, 0.1, rows),
+        "PesoClasse": np.round(rng.uniform(1, 5, rows), 4),
+        "PesoScuola": np.round(rng.uniform(1, 5, rows), 4),
+        "PesoTotale_Matematica": np.round(rng.uniform(1, 50, rows), 4),
+        "WLE_MAT": wle,
+        "WLE_MAT_200": 200 + 40 * wle,
+        "WLE_MAT_200_CORR": (200 + 40 * wle) * correction,
+        "pu_ma_no_corr": 100 * pu_ma_gr / len(QUESTIONS) * correction,
+        "n_stud_prev": rng.integers(10, 31, rows).astype(np.float64),
+        "n_classi_prev": rng.integers(1, 11, rows).astype(np.float64),
+    })
+
+    # LIVELLI in [0..5]; i livelli [0,1,2] corrispondono a DROPOUT = True.
+    livelli = np.searchsorted([-1.5, -1.0, -0.5, 0.3, 1.0], wle)
+    data["LIVELLI"] = livelli
+    data["DROPOUT"] = np.where(livelli <= 2, "True", "False").astype(object)
+
+    dataframe = pd.DataFrame(data, index=pd.RangeIndex(first_index, first_index + rows))
+    # Stesso ordine delle colonne del CSV originale.
+    return dataframe[list(COLUMN_CONVERTERS.keys())]
+
+
+def convert_original(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts a raw dataframe with the converters in COLUMN_CONVERTERS, as pd.read_csv does when reading the original
+    CSV. Each converter is called once for every distinct value of its column instead of once per record.
+    """
+    converted = {}
+    for name, converter in COLUMN_CONVERTERS.items():
+        codes, uniques = pd.factorize(dataframe[name])
+        # read_csv passa ai convertitori i valori come stringhe.
+        values = pd.Series([converter(str(value)) for value in uniques])
+        converted[name] = values.to_numpy()[codes]
+    return pd.DataFrame(converted, index=dataframe.index)
+
+
+def generate_dataset_ap(rows: int, seed: int = 19, first_index: int = 0) -> pd.DataFrame:
+    """
+    Generates rows records already cleaned and with the questions converted to ambiti and processi,
+    i.e. with the schema of CLEANED_DATASET_WITH_AP.
+    """
+    dataset = convert_original(generate_original(rows, seed, first_index))
+
+    return preprocessing.convert_domande_to_ambiti_processi(preprocessing.clean_original_dataset(dataset))
+
+
+def write_csv(file_path: str, rows: int, dataset_ap: bool = False, seed: int = 19):
+    """
+    Writes rows synthetic records to file_path in chunks of CHUNK_ROWS records, either with the schema of the
+    original dataset (';' separated, with the index column) or with the one of CLEANED_DATASET_WITH_AP.
+    """
+    for chunk, first_index in enumerate(range(0, rows, CHUNK_ROWS)):
+        chunk_rows = min(CHUNK_ROWS, rows - first_index)
+        if dataset_ap:
+            dataframe = generate_dataset_ap(chunk_rows, seed + chunk, first_index)
+            dataframe.to_csv(file_path, mode="w" if chunk == 0 else "a", header=chunk == 0, index=False)
+        else:
+            dataframe = generate_original(chunk_rows, seed + chunk, first_index)
+            dataframe.to_csv(file_path, sep=';', mode="w" if chunk == 0 else "a", header=chunk == 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates a synthetic dataset with the schema of the INVALSI one.")
+    parser.add_argument("file_path")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--dataset-ap", action="store_true",
+                        help="generate the cleaned dataset with ambiti and processi instead of the original one")
+    parser.add_argument("--seed", type=int, default=19)
+    arguments = parser.parse_args()
+
+    write_csv(arguments.file_path, arguments.rows, arguments.dataset_ap, arguments.seed)
@@ -0,0 +1,190 @@
+import json
+import os
+import resource
+import sqlite3
+import time
+from os import makedirs, path
+
+import numpy as np
+import tensorflow as tf
+
+import run_registry
+import config as cfg
+
+TELEMETRY_FILE_NAME = "telemetry.jsonl"
+# Batch che la pipeline di input può produrre in anticipo (prefetch) senza sovrascrivere istanti non ancora letti.
+READY_TIMES_MARGIN = 4096
+
+
+def peak_rss_mb() -> float:
+    # Su Linux ru_maxrss è espresso in kilobyte.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def weights_size_mb(model: tf.keras.Model) -> float:
+    return sum(int(np.prod(w.shape)) * w.dtype.size for w in model.weights) / 2 ** 20
+
+
+class ResourceMonitor(tf.keras.callbacks.Callback):
+    """
+    Records wall time, samples/sec, time blocked on the input pipeline, peak RSS and CPU utilization
+    every log_every_n_steps training steps and at the end of every epoch.
+    Records are appended as JSON lines to TELEMETRY_FILE_NAME in RESULTS_FOLDER, each one tagged with JOB_NAME.
+
+    The time blocked on the input pipeline is measured only if the training dataset is wrapped with instrument_dataset:
+    for every training step, it is the time between the beginning of the step and the instant its batch left the
+    input pipeline (0 if the batch was already prefetched). Both are host wall clock times. The instants are written
+    by the pipeline into a ring buffer indexed by batch number and read once per record, not at every batch.
+    """
+
+    def __init__(self, batch_size: int, log_every_n_steps: int, preprocessor: tf.keras.Model = None):
+        super().__init__()
+        # Evita che Keras converta i log in numpy ad ogni batch.
+        self._supports_tf_logs = True
+        self.batch_size = batch_size
+        self.log_every_n_steps = log_every_n_steps
+        self.preprocessor = preprocessor
+        self.ready_capacity = log_every_n_steps + READY_TIMES_MARGIN
+        with tf.device("/CPU:0"):
+            # Istante (secondi dall'epoch Unix) in cui ogni batch è uscito dalla pipeline di input, per numero di batch.
+            self.ready_times = tf.Variable(tf.zeros(self.ready_capacity, dtype=tf.float64), trainable=False)
+            self.produced_batches = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.instrumented = False
+        # (numero del batch, istante di inizio del training step) dei batch non ancora letti.
+        self.batch_begins = []
+        self.consumed_batches = 0
+        self.log_file = None
+        self.epoch_times = []
+
+    def instrument_dataset(self, dataset: tf.data.Dataset) -> tf.data.Dataset:
+        """
+        Appends to the pipeline a step saving, by batch number, the instant each batch leaves the pipeline.
+        It must be the last transformation of the pipeline.
+        """
+        def mark_ready(*element):
+            index = self.produced_batches.assign_add(1, read_value=True) - 1
+            update = self.ready_times.scatter_nd_update([[index % self.ready_capacity]], [tf.timestamp()])
+            with tf.control_dependencies([update]):
+                return tf.nest.map_structure(tf.identity, element)
+
+        self.instrumented = True
+        # Senza num_parallel_calls i batch vengono numerati nell'ordine in cui li ricevono i training step.
+        return dataset.map(mark_ready)
+
+    def _input_wait(self) -> float:
+        """
+        Returns the time the training steps begun since the last call waited for their batch.
+        """
+        batch_begins, self.batch_begins = self.batch_begins, []
+        if not self.instrumented or not batch_begins:
+            return 0.0
+        ready_times = self.ready_times.numpy()
+        return float(sum(max(0.0, ready_times[index % self.ready_capacity] - begin) for index, begin in batch_begins))
+
+    def _write(self, record: dict):
+        record["job_name"] = cfg.JOB_NAME
+        record["problem_type"] = cfg.PROBLEM_TYPE
+        record["time"] = time.time()
+        self.log_file.write(json.dumps(record) + "\n")
+
+    def _reset_window(self):
+        self.window_start = time.perf_counter()
+        self.window_cpu_start = time.process_time()
+        self.window_steps = 0
+
+    def _usage(self, steps: int, wall_time: float, cpu_time: float, input_wait: float) -> dict:
+        return {
+            "steps": steps,
+            "wall_time": wall_time,
+            "samples_per_sec": steps * self.batch_size / wall_time if wall_time > 0 else 0.0,
+            "input_wait_time": input_wait,
+            "peak_rss_mb": peak_rss_mb(),
+            # Percentuale rispetto a un singolo core (può superare 100).
+            "cpu_percent": 100 * cpu_time / wall_time if wall_time > 0 else 0.0,
+        }
+
+    def on_train_begin(self, logs=None):
+        makedirs(cfg.RESULTS_FOLDER, exist_ok=True)
+        self.log_file = open(path.join(cfg.RESULTS_FOLDER, TELEMETRY_FILE_NAME), "a")
+        self._write({
+            "event": "train_begin",
+            "batch_size": self.batch_size,
+            "cpu_count": os.cpu_count(),
+            "preprocessor_output_width": int(self.preprocessor.output_shape[-1]) if self.preprocessor else None,
+            "model_parameters": self.model.count_params(),
+            "model_weights_mb": weights_size_mb(self.model),
+            "peak_rss_mb": peak_rss_mb(),
+        })
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.current_epoch = epoch
+        self.epoch_start = time.perf_counter()
+        self.epoch_cpu_start = time.process_time()
+        self.epoch_steps = 0
+        self.epoch_input_wait = 0.0
+        self._reset_window()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.batch_begins.append((self.consumed_batches, time.time()))
+        self.consumed_batches += 1
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.epoch_steps += 1
+        self.window_steps += 1
+
+        if self.window_steps == self.log_every_n_steps:
+            input_wait = self._input_wait()
+            self.epoch_input_wait += input_wait
+            record = self._usage(self.window_steps,
+                                 time.perf_counter() - self.window_start,
+                                 time.process_time() - self.window_cpu_start,
+                                 input_wait)
+            record.update({"event": "steps", "epoch": self.current_epoch, "step": batch + 1})
+            self._write(record)
+            self._reset_window()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch_input_wait += self._input_wait()
+        record = self._usage(self.epoch_steps,
+                             time.perf_counter() - self.epoch_start,
+                             time.process_time() - self.epoch_cpu_start,
+                             self.epoch_input_wait)
+        record.update({"event": "epoch", "epoch": epoch})
+        self.epoch_times.append(record["wall_time"])
+        record.update({name: float(value) for name, value in (logs or {}).items()})
+        self._write(record)
+        self.log_file.flush()
+
+    def on_train_end(self, logs=None):
+        self._write({"event": "train_end", "peak_rss_mb": peak_rss_mb()})
+        self.log_file.close()
+
+
+class RegistryRecorder(tf.keras.callbacks.Callback):
+    """
+    Records the metrics of every epoch in the run registry (see run_registry.py).
+    Epochs are buffered and written in a single transaction every flush_every_epochs epochs and at the end of training.
+    Registry errors are printed and do not stop the training: the rows that could not be written are dropped.
+    """
+
+    def __init__(self, run_id: int, flush_every_epochs: int = 10):
+        super().__init__()
+        self.run_id = run_id
+        self.flush_every_epochs = flush_every_epochs
+        self.rows = []
+
+    def flush(self):
+        if self.rows:
+            try:
+                run_registry.add_history(self.run_id, self.rows)
+            except sqlite3.Error as error:
+                print(f"Run registry not available, {len(self.rows)} history rows are not registered: {error}")
+            self.rows = []
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.rows.extend((epoch, name, float(value)) for name, value in (logs or {}).items())
+        if (epoch + 1) % self.flush_every_epochs == 0:
+            self.flush()
+
+    def on_train_end(self, logs=None):
+        self.flush()
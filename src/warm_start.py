@@ -0,0 +1,239 @@
+import json
+import sqlite3
+from os import makedirs, path
+
+import numpy as np
+import tensorflow as tf
+
+import run_registry
+import save_plots
+import telemetry
+import config as cfg
+
+"""
+Avvio a caldo (WARM_START_FROM): i pesi della rete vengono inizializzati con quelli salvati da un'esecuzione
+precedente (un altro JOB_NAME con lo stesso PROBLEM_TYPE) invece che con HeNormal(seed=19).
+Ogni esecuzione salva i pesi dei layer del modello "body" e la firma del preprocessore (feature in input, vocabolari
+delle feature categoriche e dimensione dell'output): l'avvio a caldo è possibile solo se la firma è identica, perché
+altrimenti le colonne in input al primo layer Dense avrebbero un significato diverso.
+Se anche i layer hanno le stesse forme vengono trasferiti tutti i pesi, altrimenti (ad esempio con NUMBER_OF_LAYERS
+diverso) vengono trasferiti layer per layer solo i Dense con la stessa forma (i primi hidden layer e l'output layer),
+ognuno insieme alla BatchNormalization che lo segue, se presente in entrambi i modelli.
+Il guadagno dell'avvio a caldo viene misurato rispetto a COLD_BASELINE, un'esecuzione con la stessa configurazione
+avviata senza WARM_START_FROM: il confronto con WARM_START_FROM stesso non avrebbe senso, perché l'esecuzione parte
+proprio dai suoi pesi migliori.
+"""
+
+WEIGHTS_FILE_NAME = "body_weights.npz"
+SIGNATURE_FILE_NAME = "signature.json"
+
+# Chiavi di configurazione che non influenzano il training, ignorate nel confronto con COLD_BASELINE.
+BASELINE_IGNORED_KEYS = ["JOB_NAME", "WARM_START_FROM", "COLD_BASELINE", "TARGET_LOSS", "EVALUATION_BATCH_SIZE",
+                         "TELEMETRY", "TELEMETRY_STEPS", "PROFILING", "PROFILE_STAGES", "PROFILE_STEPS", "PLOT_LAYOUT", "SAVE_TEST_SET",
+                         "RUN_REGISTRY"]
+
+
+def results_folder(job_name: str) -> str:
+    return path.join("src", "results", job_name, cfg.PROBLEM_TYPE)
+
+
+def layers_description(body: tf.keras.Model) -> list:
+    return [{"class": layer.__class__.__name__, "shapes": [list(weight.shape) for weight in layer.get_weights()]}
+            for layer in body.layers]
+
+
+def save(body: tf.keras.Model, signature: dict):
+    """
+    Saves the weights of the layers of body and the preprocessor signature in RESULTS_FOLDER.
+    """
+    makedirs(cfg.RESULTS_FOLDER, exist_ok=True)
+    np.savez(path.join(cfg.RESULTS_FOLDER, WEIGHTS_FILE_NAME),
+             **{f"{i}_{j}": weight for i, layer in enumerate(body.layers) for j, weight in enumerate(layer.get_weights())})
+    with open(path.join(cfg.RESULTS_FOLDER, SIGNATURE_FILE_NAME), "w") as signature_file:
+        json.dump({"preprocessor": signature, "layers": layers_description(body)}, signature_file)
+
+
+def load(job_name: str) -> tuple:
+    """
+    Returns the saved signature and the weights of every layer of body of job_name.
+    """
+    folder = results_folder(job_name)
+    with open(path.join(folder, SIGNATURE_FILE_NAME)) as signature_file:
+        signature = json.load(signature_file)
+    with np.load(path.join(folder, WEIGHTS_FILE_NAME)) as weights_file:
+        weights = [[weights_file[f"{i}_{j}"] for j in range(len(layer["shapes"]))]
+                   for i, layer in enumerate(signature["layers"])]
+    return signature, weights
+
+
+def incompatibilities(source: dict, target: dict) -> list:
+    """
+    Returns the differences between two preprocessor signatures (empty if the warm start is possible).
+    """
+    differences = []
+    for key in sorted(set(source) | set(target)):
+        if key == "vocabularies":
+            continue
+        if source.get(key) != target.get(key):
+            differences.append(f"{key}: {source.get(key)} -> {target.get(key)}")
+    source_vocabularies = source.get("vocabularies", {})
+    target_vocabularies = target.get("vocabularies", {})
+    for name in sorted(set(source_vocabularies) | set(target_vocabularies)):
+        if source_vocabularies.get(name) != target_vocabularies.get(name):
+            differences.append(f"vocabulary of {name}")
+    return differences
+
+
+def shapes(weights: list) -> list:
+    return [list(weight.shape) for weight in weights]
+
+
+def following_batch_normalization(classes: list, dense_index: int):
+    """
+    Returns the index of the BatchNormalization layer between the Dense layer at dense_index and the next Dense layer,
+    or None if there is none.
+    """
+    for index in range(dense_index + 1, len(classes)):
+        if classes[index] == "Dense":
+            return None
+        if classes[index] == "BatchNormalization":
+            return index
+    return None
+
+
+def transfer_weights(source_layers: list, source_weights: list, body: tf.keras.Model) -> list:
+    """
+    Copies the source weights into the layers of body and returns the descriptions of the transferred layers.
+    With the same layers, every weight is copied; otherwise only the Dense layers with the same shapes,
+    pairing the hidden layers from the input side and the output layers, each with the BatchNormalization layer
+    following it if both models have one.
+    """
+    if [layer["shapes"] for layer in source_layers] == [layer["shapes"] for layer in layers_description(body)] and \
+            [layer["class"] for layer in source_layers] == [layer.__class__.__name__ for layer in body.layers]:
+        for layer, weights in zip(body.layers, source_weights):
+            layer.set_weights(weights)
+        return [f"{layer.name} ({layer.__class__.__name__})" for layer in body.layers if layer.weights]
+
+    source_classes = [layer["class"] for layer in source_layers]
+    target_classes = [layer.__class__.__name__ for layer in body.layers]
+    source_dense = [i for i, layer_class in enumerate(source_classes) if layer_class == "Dense"]
+    target_dense = [i for i, layer_class in enumerate(target_classes) if layer_class == "Dense"]
+    if not source_dense or not target_dense:
+        return []
+    pairs = list(zip(source_dense[:-1], target_dense[:-1])) + [(source_dense[-1], target_dense[-1])]
+
+    transferred = []
+    for source_index, target_index in pairs:
+        # La BatchNormalization che segue il Dense ne normalizza l'output: le sue statistiche valgono solo per quei pesi.
+        source_indexes = [source_index, following_batch_normalization(source_classes, source_index)]
+        target_indexes = [target_index, following_batch_normalization(target_classes, target_index)]
+        if source_indexes[1] is None or target_indexes[1] is None:
+            source_indexes, target_indexes = source_indexes[:1], target_indexes[:1]
+
+        if not all(shapes(source_weights[i]) == shapes(body.layers[j].get_weights())
+                   for i, j in zip(source_indexes, target_indexes)):
+            # I layer successivi riceverebbero input diversi da quelli con cui sono stati addestrati.
+            break
+        for i, j in zip(source_indexes, target_indexes):
+            body.layers[j].set_weights(source_weights[i])
+            transferred.append(f"{body.layers[j].name} ({target_classes[j]})")
+    return transferred
+
+
+def warm_start(body: tf.keras.Model, signature: dict) -> bool:
+    """
+    Initializes body with the weights saved by WARM_START_FROM, if compatible. Returns whether weights were transferred.
+    """
+    try:
+        source, weights = load(cfg.WARM_START_FROM)
+    except FileNotFoundError:
+        print(f"Warm start skipped: {cfg.WARM_START_FROM} has no saved weights for {cfg.PROBLEM_TYPE}.")
+        return False
+
+    differences = incompatibilities(source["preprocessor"], signature)
+    if differences:
+        print(f"Warm start skipped: the preprocessor of {cfg.WARM_START_FROM} is not compatible:")
+        for difference in differences:
+            print(f"  {difference}")
+        return False
+
+    transferred = transfer_weights(source["layers"], weights, body)
+    print(f"Warm start from {cfg.WARM_START_FROM}: transferred {len(transferred)} layers")
+    for layer in transferred:
+        print(f"  {layer}")
+    return len(transferred) > 0
+
+
+def time_to_target(val_losses: list, epoch_times: list, target: float) -> tuple:
+    """
+    Returns the first epoch (1-based) with a validation loss <= target and the training time until its end
+    (None if the epoch times are not known), or (None, None) if the target is never reached.
+    """
+    for epoch, val_loss in enumerate(val_losses):
+        if val_loss <= target:
+            seconds = float(np.sum(epoch_times[:epoch + 1])) if len(epoch_times) > epoch else None
+            return epoch + 1, seconds
+    return None, None
+
+
+def cold_epoch_times(job_name: str) -> list:
+    telemetry_path = path.join(results_folder(job_name), telemetry.TELEMETRY_FILE_NAME)
+    if not path.exists(telemetry_path):
+        return []
+    with open(telemetry_path) as telemetry_file:
+        records = [json.loads(line) for line in telemetry_file]
+    # Il file contiene tutte le esecuzioni dello stesso JOB_NAME: si considera solo l'ultima.
+    starts = [i for i, record in enumerate(records) if record["event"] == "train_begin"]
+    last_run = records[starts[-1]:] if starts else records
+    return [record["wall_time"] for record in last_run if record["event"] == "epoch"]
+
+
+def baseline_differences(job_name: str) -> list:
+    """
+    Returns the configuration keys affecting training whose value in the last registered run of job_name differs from
+    the one of this run, or None if job_name is not in the run registry (or the registry is not available).
+    """
+    try:
+        baseline = run_registry.job_config(job_name, cfg.PROBLEM_TYPE)
+    except sqlite3.Error:
+        return None
+    if not baseline:
+        return None
+    return [f"{key}: {baseline.get(key)} -> {value}" for key, value in cfg.config_dict().items()
+            if key not in BASELINE_IGNORED_KEYS and baseline.get(key) != str(value)]
+
+
+def print_time_to_target(history: dict, epoch_times: list):
+    """
+    Compares the time to reach the target validation loss (TARGET_LOSS, or the best validation loss of COLD_BASELINE)
+    of this warm started run with the one of the cold run COLD_BASELINE, trained with the same configuration.
+    """
+    if not cfg.COLD_BASELINE:
+        print("Time to target loss not compared: set COLD_BASELINE to the JOB_NAME of a run with the same "
+              "configuration started without WARM_START_FROM.")
+        return
+    cold_image_folder = path.join(save_plots.IMAGES_ROOT, cfg.COLD_BASELINE, cfg.PROBLEM_TYPE)
+    if not path.exists(path.join(cold_image_folder, save_plots.HISTORY_FILE_NAME)):
+        print(f"Time to target loss not available: {cfg.COLD_BASELINE} has no saved history.")
+        return
+
+    differences = baseline_differences(cfg.COLD_BASELINE)
+    if differences is None:
+        print(f"The configuration of {cfg.COLD_BASELINE} is not in the run registry and cannot be checked.")
+    elif differences:
+        print(f"Time to target loss not compared: {cfg.COLD_BASELINE} was trained with a different configuration:")
+        for difference in differences:
+            print(f"  {difference}")
+        return
+
+    cold_history = save_plots.load_history(cold_image_folder)
+    target = float(cfg.TARGET_LOSS) if cfg.TARGET_LOSS else min(cold_history["val_loss"])
+    print(f"Time to validation loss {target:.4f}:")
+    for name, val_losses, times in [("cold start (" + cfg.COLD_BASELINE + ")", cold_history["val_loss"],
+                                     cold_epoch_times(cfg.COLD_BASELINE)),
+                                    ("warm start (" + cfg.JOB_NAME + ")", history["val_loss"], epoch_times)]:
+        epoch, seconds = time_to_target(val_losses, times, target)
+        if epoch is None:
+            print(f"  {name}: not reached in {len(val_losses)} epochs")
+        else:
+            print(f"  {name}: epoch {epoch}" + (f", {seconds:.1f}s" if seconds is not None else ""))